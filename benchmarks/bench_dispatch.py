@@ -0,0 +1,110 @@
+"""WS 消息分发 → PipeWriter → FIFO 的逐帧复制开销
+
+对比旧的 `data[1:]` 复制分发 (legacy_copy) 与当前的 memoryview 零复制分发，
+统计每条消息分配的字节数与耗时。legacy_copy 不做 NAL 解析等处理，耗时仅供参考。
+FIFO 由 cat 子进程读取并丢弃，因此统计只包含本进程内的分配。
+
+    python benchmarks/bench_dispatch.py [--frames 2000] [--json]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import micam
+from micam import PipeWriter, RTSPBridge
+
+KEYFRAME_SIZE = 300 * 1024
+INTER_SIZE = 15 * 1024
+AUDIO_SIZE = 320
+GOP = 50
+
+class CopyingBridge(RTSPBridge):
+    """旧版分发逻辑: 每帧 data[1:] 复制一次"""
+    def _on_message(self, data):
+        if len(data) > 1:
+            p_type = data[0]
+            payload = data[1:]
+            output = self.outputs[0]
+            if p_type == 1: output.video_writer.write(payload)
+            elif p_type == 2: output.audio_writer.write(payload)
+
+def make_messages(frames):
+    # Annex-B 起始码 + HEVC NAL 头 (IDR_W_RADL / TRAIL_R)，负载为随机数据
+    key = b"\x01\x00\x00\x00\x01\x26\x01" + os.urandom(KEYFRAME_SIZE)
+    inter = b"\x01\x00\x00\x00\x01\x02\x01" + os.urandom(INTER_SIZE)
+    audio = b"\x02" + os.urandom(AUDIO_SIZE)
+    for i in range(frames):
+        yield key if i % GOP == 0 else inter
+        yield audio
+
+async def run(bridge_cls, frames):
+    tmp = tempfile.mkdtemp(prefix="micam_bench_")
+    bridge = bridge_cls("http://127.0.0.1", "admin", "", "bench", "rtsp://127.0.0.1/bench", "hevc", 0, 2)
+    output = bridge.outputs[0]
+    output.video_writer = PipeWriter(os.path.join(tmp, "video.pipe"), "Video")
+    output.audio_writer = PipeWriter(os.path.join(tmp, "audio.pipe"), "Audio")
+    readers = []
+    for writer in (output.video_writer, output.audio_writer):
+        writer.start()
+        readers.append(subprocess.Popen(["cat", writer.pipe_path], stdout=subprocess.DEVNULL))
+
+    copied = 0
+    payload_bytes = 0
+    elapsed = 0.0
+    tracemalloc.start()
+    for data in make_messages(frames):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        bridge._on_message(data)
+        elapsed += time.perf_counter() - t0
+        copied += tracemalloc.get_traced_memory()[1] - base
+        payload_bytes += len(data) - 1
+        # 让事件循环处理 add_writer 回调，排空积压的管道数据
+        await asyncio.sleep(0)
+    tracemalloc.stop()
+
+    while output.video_writer.queue or output.audio_writer.queue:
+        await asyncio.sleep(0.01)
+    output.video_writer.close()
+    output.audio_writer.close()
+    for reader in readers:
+        reader.wait()
+    os.rmdir(tmp)
+
+    messages = frames * 2
+    return {
+        "messages": messages,
+        "payload_bytes_per_msg": payload_bytes / messages,
+        "bytes_allocated_per_msg": copied / messages,
+        "ns_per_msg": elapsed / messages * 1e9,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    micam.logger.setLevel("WARNING")
+
+    results = {
+        "legacy_copy": asyncio.run(run(CopyingBridge, args.frames)),
+        "zero_copy": asyncio.run(run(RTSPBridge, args.frames)),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<12} {'payload B/msg':>14} {'alloc B/msg':>12} {'ns/msg':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<12} {r['payload_bytes_per_msg']:>14.0f} {r['bytes_allocated_per_msg']:>12.0f} {r['ns_per_msg']:>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""WS 接收 → PipeWriter → FIFO 链路的吞吐、延迟与 CPU 基准
+
+模拟服务 (micam.fake_miloco) 运行在独立进程中，本进程在同一个事件循环里运行 N 个
+RTSPBridge，完整经过登录、WS 接收、run_session 分发与 PipeWriter 写入。ffmpeg 替换为
+读取并丢弃 FIFO 的 cat，CPU 只统计 micam 进程本身。
+
+每个场景报告:
+- 消息数/s、MB/s (bridge 实际收到的)
+- PipeWriter.write 每次调用耗时，以及扣除同步写管道后的纯入队耗时
+- _flush 每次调用耗时 (含 os.write)
+- 附加延迟: write() 入队到数据完整写入 FIFO 的时间 (p50/p99/max)
+- 每个摄像头占用的 CPU 百分比与事件循环最大延迟
+
+    python benchmarks/bench_pipeline.py [--cameras 1,10,50,100] [--duration 10] [--json]
+
+--saturate-fps 额外运行一个单摄像头高帧率场景，测量分发循环的最大吞吐；
+结果中 cpu_percent 接近 100 说明 micam 已饱和，否则瓶颈在模拟服务。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import collections
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import micam
+from micam import PipeWriter, RTSPBridge, RTSPOutput, DROP_NEWEST
+from micam.metrics import LoopLag
+from micam.miloco import SessionPool
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.write_calls = 0
+        self.write_time = 0.0
+        self.inline_flush_time = 0.0
+        self.flush_calls = 0
+        self.flush_time = 0.0
+        self.latency = {"video": [], "audio": []}
+
+STATS = Stats()
+
+class TimedPipeWriter(PipeWriter):
+    """记录每次 write/_flush 的耗时，以及每项数据从入队到写完的延迟
+
+    基准中使用 DROP_NEWEST 策略，队列只会在队尾追加、在队首写完，入队时间戳可以与队列一一对应。
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stream = "video" if self.name.endswith("Video") else "audio"
+        self.stamps = collections.deque()
+        self._in_write = False
+
+    def write(self, data, keyframe=False, at=None) -> bool:
+        t0 = time.perf_counter()
+        self.stamps.append(t0)
+        self._in_write = True
+        accepted = super().write(data, keyframe, at)
+        self._in_write = False
+        if not accepted: self.stamps.pop()
+        STATS.write_calls += 1
+        STATS.write_time += time.perf_counter() - t0
+        return accepted
+
+    def _flush(self):
+        t0 = time.perf_counter()
+        before = len(self.queue)
+        super()._flush()
+        now = time.perf_counter()
+        for _ in range(before - len(self.queue)):
+            STATS.latency[self.stream].append(now - self.stamps.popleft())
+        STATS.flush_calls += 1
+        STATS.flush_time += now - t0
+        if self._in_write: STATS.inline_flush_time += now - t0
+
+    def close(self):
+        super().close()
+        self.stamps.clear()
+
+class BenchOutput(RTSPOutput):
+    def _ffmpeg_command(self):
+        # 代替 ffmpeg 持续读取两个 FIFO
+        return ["sh", "-c", f"cat {self.pipe_video} > /dev/null & cat {self.pipe_audio} > /dev/null; wait"]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def fake_stats(session, url):
+    async with session.get(f"{url}/stats") as r:
+        data = await r.json()
+    return sum(s["messages"] for s in data["streams"].values()), sum(s["bytes"] for s in data["streams"].values())
+
+async def run_scenario(cameras, duration, fps, bitrate, warmup):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "micam.fake_miloco", "--port", str(port), "--fps", str(fps), "--bitrate", str(bitrate)],
+        cwd=ROOT, env={**os.environ, "PYTHONPATH": ROOT}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    http = aiohttp.ClientSession()
+    pool = SessionPool()
+    tasks = []
+    try:
+        for _ in range(100):
+            try:
+                await fake_stats(http, url)
+                break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+
+        bridges = [RTSPBridge(url, "admin", "", f"bench{i}", "rtsp://unused", "hevc", 0, 2,
+                               name=f"bench{os.getpid()}_{i}", session_pool=pool, drop_policy=DROP_NEWEST)
+                   for i in range(cameras)]
+        tasks = [asyncio.ensure_future(b.run_forever()) for b in bridges]
+        loop_lag = LoopLag(interval=0.1)
+        tasks.append(asyncio.ensure_future(loop_lag.run()))
+
+        # 预热: 所有摄像头都已开始写入 FIFO
+        deadline = time.monotonic() + warmup
+        while time.monotonic() < deadline and not all("first_write" in b._session_marks for b in bridges):
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1)
+
+        STATS.reset()
+        loop_lag.max_lag = 0.0
+        received = [sum(s[i] for b in bridges for s in b.received.values()) for i in (0, 1)]
+        sent = await fake_stats(http, url)
+        cpu0, t0 = time.process_time(), time.monotonic()
+        await asyncio.sleep(duration)
+        cpu, elapsed = time.process_time() - cpu0, time.monotonic() - t0
+        received = [sum(s[i] for b in bridges for s in b.received.values()) - received[i] for i in (0, 1)]
+        sent = [n - m for n, m in zip(await fake_stats(http, url), sent)]
+
+        def ms(v): return round(v * 1000, 3)
+        result = {
+            "cameras": cameras,
+            "fps": fps,
+            "bitrate_kbps": bitrate,
+            "duration_s": round(elapsed, 2),
+            "messages_per_s": round(received[0] / elapsed, 1),
+            "mb_per_s": round(received[1] / elapsed / 1e6, 3),
+            "sent_messages_per_s": round(sent[0] / elapsed, 1),
+            "write_ns": round(STATS.write_time / max(STATS.write_calls, 1) * 1e9),
+            "enqueue_ns": round((STATS.write_time - STATS.inline_flush_time) / max(STATS.write_calls, 1) * 1e9),
+            "flush_ns": round(STATS.flush_time / max(STATS.flush_calls, 1) * 1e9),
+            "cpu_percent": round(cpu / elapsed * 100, 2),
+            "cpu_percent_per_camera": round(cpu / elapsed * 100 / cameras, 3),
+            "loop_lag_max_ms": ms(loop_lag.max_lag),
+            "dropped_frames": sum(o.dropped[s][0] + (w.dropped_frames if w else 0) for b in bridges for o in b.outputs
+                                  for s, w in (("video", o.video_writer), ("audio", o.audio_writer))),
+            "reconnects": sum(b.reconnects for b in bridges),
+        }
+        for stream, values in STATS.latency.items():
+            result[f"{stream}_latency_ms"] = {
+                "p50": ms(statistics.median(values)) if values else 0.0,
+                "p99": ms(percentile(values, 0.99)),
+                "max": ms(max(values, default=0.0)),
+            }
+        return result
+    finally:
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await pool.close()
+        await http.close()
+        fake.terminate()
+        fake.wait()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cameras", default="1,10,50,100", help="comma separated camera counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="measurement window per scenario")
+    parser.add_argument("--warmup", type=float, default=15.0, help="max seconds to wait for all cameras to stream")
+    parser.add_argument("--fps", type=int, default=20)
+    parser.add_argument("--bitrate", type=int, default=2000, help="per camera bitrate in kbps")
+    parser.add_argument("--saturate-fps", type=int, default=10000, help="fps of the single camera saturation run (0: skip)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    micam.logger.setLevel("WARNING")
+    # RTSPBridge/_start_ffmpeg 按模块全局名创建 RTSPOutput 与 PipeWriter
+    micam.PipeWriter = TimedPipeWriter
+    micam.RTSPOutput = BenchOutput
+
+    scenarios = [(int(n), args.fps, args.bitrate) for n in args.cameras.split(",")]
+    if args.saturate_fps:
+        # 保持每帧大小不变，只提高帧率
+        scenarios.append((1, args.saturate_fps, args.bitrate * args.saturate_fps // args.fps))
+    results = [asyncio.run(run_scenario(n, args.duration, fps, bitrate, args.warmup)) for n, fps, bitrate in scenarios]
+
+    if args.json:
+        print(json.dumps({
+            "micam_version": micam_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": int(time.time()),
+            "results": results,
+        }, indent=2))
+        return
+    print(f"{'cams':>5} {'fps':>5} {'msg/s':>9} {'MB/s':>7} {'write ns':>9} {'enq ns':>7} {'flush ns':>9} "
+          f"{'v p50 ms':>9} {'v p99 ms':>9} {'cpu %':>7} {'cpu %/cam':>9} {'lag ms':>7} {'drops':>6}")
+    for r in results:
+        print(f"{r['cameras']:>5} {r['fps']:>5} {r['messages_per_s']:>9.0f} {r['mb_per_s']:>7.2f} {r['write_ns']:>9} "
+              f"{r['enqueue_ns']:>7} {r['flush_ns']:>9} {r['video_latency_ms']['p50']:>9.3f} {r['video_latency_ms']['p99']:>9.3f} "
+              f"{r['cpu_percent']:>7.1f} {r['cpu_percent_per_camera']:>9.2f} {r['loop_lag_max_ms']:>7.1f} {r['dropped_frames']:>6}")
+
+def micam_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+if __name__ == "__main__":
+    main()
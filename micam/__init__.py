@@ -1,15 +1,25 @@
 import os
+import json
 import asyncio
 import aiohttp
 import argparse
 import logging
 import subprocess
-import threading
-import queue
 import time
 import sys
 import signal
 from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from . import nal
+from .analysis import AudioLevel, StreamStats, VideoActivity
+from .capture import CaptureReader, CaptureWriter
+from .events import EventSink
+from .metrics import Histogram, MetricsServer
+from .miloco import SessionPool
+from .ondemand import ConsumerMonitor, go2rtc_streams_url
+from .output import DROP_NEWEST, DROP_KEYFRAME, DROP_POLICIES, GopBuffer, PipeWriter
+from .rtsp import RTSPPublisher, AUDIO_L16, AUDIO_PCMA, AUDIO_CODECS
 
 # 配置日志
 logging.basicConfig(
@@ -18,117 +28,189 @@ logging.basicConfig(
 )
 logger = logging.getLogger("Bridge")
 
-class PipeWriter(threading.Thread):
-    """独立线程负责写入命名管道，防止阻塞"""
-    def __init__(self, pipe_path, name):
-        super().__init__(daemon=True)
-        self.pipe_path = pipe_path
-        self.name = name
-        self.queue = queue.Queue(maxsize=1000)
-        self.fd = None
-        self.running = True
-        self._ensure_pipe()
-
-    def _ensure_pipe(self):
-        try:
-            if os.path.exists(self.pipe_path):
-                os.remove(self.pipe_path)
-            os.mkfifo(self.pipe_path)
-            # O_RDWR 防止 Linux/macOS 上 open 阻塞
-            self.fd = os.open(self.pipe_path, os.O_RDWR)
-            logger.info(f"[{self.name}] Pipe opened: {self.pipe_path}")
-        except Exception as e:
-            logger.error(f"[{self.name}] Failed to create/open pipe: {e}")
-            self.running = False
-
-    def write(self, data):
-        if not self.running: return
-        try:
-            self.queue.put(data, timeout=0.01)
-        except queue.Full:
-            pass 
+# 小米摄像头音频: G.711A 16k 单声道，每个样本 1 字节
+AUDIO_SAMPLE_RATE = 16000
+ALAW_SILENCE = 0xD5
+# 输出的音频时间戳按样本数生成，与墙上时间的偏差超过阈值时校正:
+# 落后 (断线、队列丢弃) 补静音，超前 (网络抖动后突发到达) 裁掉多余样本。
+# 裁剪阈值更宽，避免正常抖动下反复裁剪再补静音
+AUDIO_GAP_FILL = 0.2
+AUDIO_BURST_TRIM = 0.5
 
-    def run(self):
-        while self.running:
-            try:
-                data = self.queue.get(timeout=1.0)
-                if self.fd:
-                    os.write(self.fd, data)
-            except queue.Empty:
-                continue
-            except OSError as e:
-                logger.error(f"[{self.name}] Write error: {e}")
-                break
-            except Exception as e:
-                logger.error(f"[{self.name}] Error: {e}")
-                break
-        self.close()
-
-    def close(self):
-        self.running = False
-        if self.fd:
-            try: os.close(self.fd)
-            except: pass
-            self.fd = None
-        if os.path.exists(self.pipe_path):
-            try: os.remove(self.pipe_path)
-            except: pass
+# 会话启动阶段，耗时均相对 run_session 开始计算
+SESSION_PHASES = ("login", "ws_connect", "first_message", "first_keyframe", "first_write")
 
-class RTSPBridge:
-    def __init__(self, base_url, username, password, camera_id, rtsp_url, video_codec, channel, video_quality):
-        self.base_url = base_url.rstrip('/')
-        self.username = username
-        self.password = password
-        self.camera_id = camera_id
-        self.channel = str(channel)
-        self.video_quality = str(video_quality)
-        self.video_codec = video_codec
+# RTSP 推流方式: ffmpeg 子进程 + FIFO，或内置的 asyncio RTSP 客户端
+PUBLISHER_FFMPEG = "ffmpeg"
+PUBLISHER_NATIVE = "native"
+PUBLISHERS = (PUBLISHER_FFMPEG, PUBLISHER_NATIVE)
+
+# 按需推流时查询观看者的间隔 (秒)
+ON_DEMAND_POLL = 1.0
+
+# 回放结束时等待输出把剩余数据推送完的最长时间 (秒)
+FINISH_TIMEOUT = 10.0
+
+# 卡顿检测: 视频帧间隔超过实测帧间隔的 stall_factor 倍 (不少于 stall_min 秒，默认 STALL_MIN) 时立即重连 WS，
+# 下限避免 Wi-Fi 短暂抖动就重连 (重连后还要等待下一个关键帧)；
+# 输出推流建立后，视频队列有积压却持续 OUTPUT_STALL_MIN 秒以上没有写出 (ffmpeg 不再读取 FIFO、RTSP 连接阻塞) 时重启该输出
+STALL_FACTOR = 10
+STALL_MIN = 2.0
+OUTPUT_STALL_MIN = 2.0
+STALL_CHECK = 0.25
+
+# 输出重启间隔 (秒)，因卡顿连续重启时逐次加倍，不超过 OUTPUT_RESTART_MAX
+OUTPUT_RESTART_DELAY = 3.0
+OUTPUT_RESTART_MAX = 60.0
+
+# 视频编码: 指定 hevc/h264，或根据码流中的参数集自动识别
+VIDEO_CODEC_AUTO = "auto"
+VIDEO_CODECS = (nal.HEVC, nal.H264, VIDEO_CODEC_AUTO)
+
+def redact_url(url):
+    """去掉 URL 中的密码，用于 /status 等对外输出"""
+    parts = urlsplit(url)
+    if not parts.password: return url
+    return urlunsplit(parts._replace(netloc=parts.netloc.replace(f":{parts.password}@", ":***@", 1)))
+
+class RTSPOutput:
+    """一路 RTSP 推流: ffmpeg 子进程 + FIFO，或内置 RTSP 客户端
+
+    同一摄像头的多路输出由 RTSPBridge 从同一个 WS 分发，每路有独立的队列、丢弃策略、音频时间轴与重启逻辑，
+    某一路下游变慢或断开只会在自己的队列中丢帧，不阻塞 WS 接收与其他输出。
+    """
+    def __init__(self, bridge, rtsp_url, index=0):
+        self.bridge = bridge
         self.rtsp_url = rtsp_url
-        self.process: Optional[subprocess.Popen] = None
-        
-        self.pipe_video = f"/tmp/miot_video_{camera_id}.pipe"
-        self.pipe_audio = f"/tmp/miot_audio_{camera_id}.pipe"
-        
+        self.index = index
+        # 第一路沿用摄像头名称与管道路径
+        self.name = f"{bridge.name}#{index}" if index else bridge.name
+        suffix = f"_{index}" if index else ""
+        self.pipe_video = f"/tmp/miot_video_{bridge.name}{suffix}.pipe"
+        self.pipe_audio = f"/tmp/miot_audio_{bridge.name}{suffix}.pipe"
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.rtsp: Optional[RTSPPublisher] = None
         self.video_writer = None
         self.audio_writer = None
+        self._inject_param_sets = False
+        self.dropped = {"video": [0, 0], "audio": [0, 0]}  # 已关闭的队列累计丢弃 [帧数, 字节数]
+        self.restarts = 0
+        self.stalls = 0
+        self._ffmpeg_start = 0.0
+        self.published = False  # RTSP 推流已建立 (ffmpeg 输出头已写入 / 内置推流已 RECORD)
+        # 卡顿检测: 最近一次看到视频队列写出进展的时间
+        self._written = 0
+        self._progress_at = 0.0
+        self._aborts = 0  # 连续因卡顿重启的次数
+        self._aborted = False  # 本次退出由卡顿检测触发
+        self._published_at = 0.0
+        self.finishing = False  # 输入已结束，输出退出后不再重启
+        # 音频时间轴: 当前输出已接受的样本数对比墙上时间，换新的输出后重新计时
+        self.audio_drift = 0.0   # 最近一次测得的偏差 (秒)，正数为音频超前
+        self.audio_filled = 0    # 累计补入的静音样本数
+        self.audio_trimmed = 0   # 累计裁掉的样本数
+        self._audio_timeline = None
+        self._audio_anchor = 0.0
+        self._audio_samples = 0
+        self._audio_logged = 0.0
 
-    async def _login(self, session) -> bool:
-        try:
-            await session.post(f"{self.base_url}/api/auth/login", 
-                             json={"username": self.username, "password": self.password}, ssl=False)
-            async with session.get(f"{self.base_url}/api/miot/login_status", ssl=False) as r:
-                return r.status == 200
-        except Exception as e:
-            logger.error(f"Login error: {e}")
-            return False
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None or self.rtsp is not None and self.rtsp.connected
 
-    def _start_ffmpeg(self):
-        self.video_writer = PipeWriter(self.pipe_video, "Video")
-        self.audio_writer = PipeWriter(self.pipe_audio, "Audio")
+    def consuming(self, now, limit) -> bool:
+        """视频队列为空或 limit 秒内有写出进展
+
+        推流建立前 (ffmpeg 启动、RTSP 握手、重启间隔) 不判断: 下游较慢时握手本身就可能超过 limit。
+        """
+        writer = self.video_writer
+        if not writer or not self.published or not self.running or not writer.queued_bytes or writer.written_bytes != self._written:
+            self._written = writer.written_bytes if writer else 0
+            self._progress_at = now
+            return True
+        return now - self._progress_at <= limit
+
+    def abort(self):
+        """输出不再消费数据时强制结束，按退避后的重启间隔重新推流"""
+        self.stalls += 1
+        # 推流稳定运行较长时间后才卡顿的，从正常间隔重新退避
+        if time.monotonic() - self._published_at > OUTPUT_RESTART_MAX: self._aborts = 0
+        self._aborts += 1
+        self._aborted = True
+        if self.process and self.process.returncode is None:
+            # ffmpeg 可能阻塞在写 RTSP 上，不会响应 SIGTERM
+            try: self.process.kill()
+            except ProcessLookupError: pass
+        if self.rtsp: self.rtsp.close()
+
+    def _restart_delay(self) -> float:
+        """本次退出后的重启间隔
+
+        因卡顿连续重启时逐次加倍，下游持续过慢时避免反复杀掉刚完成握手的进程；
+        其他原因退出 (ffmpeg 自行退出、连接断开) 说明上一次推流正常结束，恢复正常间隔。
+        """
+        if not self._aborted: self._aborts = 0
+        self._aborted = False
+        return min(OUTPUT_RESTART_DELAY * 2 ** max(self._aborts - 1, 0), OUTPUT_RESTART_MAX)
+
+    def _begin(self):
+        """新的输出必须从关键帧开始，先送入缓存的 GOP"""
+        self.resync()
+        self.bridge._arm_first_write(self.video_writer)
+        self._write_cached_gop()
+
+    def resync(self):
+        """丢弃视频直到下一个关键帧，并在关键帧之前插入参数集 (新的输出或 WS 重连后)"""
+        if self.video_writer: self.video_writer.resync()
+        self._inject_param_sets = True
+
+    async def _start_ffmpeg(self):
+        bridge = self.bridge
+        self.video_writer = PipeWriter(self.pipe_video, f"{self.name}/Video", bridge.video_queue_bytes, bridge.drop_policy)
+        # 音频为裸 PCM，任意位置丢弃都不影响解码
+        self.audio_writer = PipeWriter(self.pipe_audio, f"{self.name}/Audio", bridge.audio_queue_bytes, DROP_NEWEST)
         self.video_writer.start()
         self.audio_writer.start()
+        self._begin()
 
-        ffmpeg_cmd = [
+        ffmpeg_cmd = self._ffmpeg_command()
+        logger.info(f"[{self.name}] Starting FFmpeg ({'PCMA' if bridge.audio_codec == AUDIO_PCMA else 'PCM'} Output, Low CPU)...")
+        self._ffmpeg_start = time.monotonic()
+        self.published = False
+        self.process = await asyncio.create_subprocess_exec(
+            *ffmpeg_cmd, 
+            stdout=subprocess.DEVNULL, 
+            stderr=subprocess.PIPE
+        )
+
+    def _ffmpeg_command(self):
+        return [
             'ffmpeg',
             '-y',
-            '-v', 'error', # 生产模式只看错误
+            # info 级别用于识别 RTSP 推流建立 (Output #0)，日志中仍只记录错误
+            '-v', 'info',
+            '-nostats',
             '-hide_banner',
             
             # [全局时间戳控制]
             '-use_wallclock_as_timestamps', '1',
             '-fflags', '+genpts+nobuffer', 
             '-flags', 'low_delay',
-            '-analyzeduration', '1000000', 
-            '-probesize', '1000000',       
 
             # --- 输入 1: 视频 (裸流) ---
-            '-f', self.video_codec, 
+            # 编码已知，参数集在第一个关键帧之前注入，无需长时间探测码流
+            '-analyzeduration', '0',
+            '-probesize', '32',
+            '-f', self.bridge.video_codec,
             '-use_wallclock_as_timestamps', '1', # 视频依赖 Wallclock
             '-i', self.pipe_video,
 
             # --- 输入 2: 音频 (G.711A) ---
-            '-f', 'alaw', 
-            '-ar', '16000', # 锁定 16k (小米高清常见配置)
+            # 探测参数按输入生效，格式已完全指定，默认 5MB 的探测在 16KB/s 的音频上要等待约 3 秒
+            '-analyzeduration', '0',
+            '-probesize', '32',
+            '-f', 'alaw',
+            '-ar', str(AUDIO_SAMPLE_RATE), # 锁定 16k (小米高清常见配置)
             '-ac', '1',
             # [关键] 音频不使用 Wallclock，依赖下方滤镜重构
             '-i', self.pipe_audio,
@@ -140,16 +222,10 @@ class RTSPBridge:
             # --- 编码与处理 ---
             
             # 视频: 透传 (Copy) - 不消耗 CPU
-            '-c:v', 'copy', 
-            '-bsf:v', 'hevc_mp4toannexb', 
+            # 输入已是 Annex-B 裸流，无需 mp4toannexb (hevc_mp4toannexb 也不能用于 H.264)
+            '-c:v', 'copy',
 
-            # 音频: PCM (s16le) - 极低 CPU
-            # [关键] 使用 asetpts 根据样本计数重写时间戳，消除网络抖动带来的延迟
-            '-af', 'aresample=16000,asetpts=N/SR/TB',
-            
-            '-c:a', 'pcm_s16le', 
-            '-ar', '16000',     # 输出 16k 给 Go2RTC
-            '-ac', '1',
+            *self._ffmpeg_audio_args(),
 
             # --- 输出 RTSP ---
             '-f', 'rtsp',
@@ -157,96 +233,917 @@ class RTSPBridge:
             self.rtsp_url,
         ]
 
-        logger.info("Starting FFmpeg (PCM Output, Low CPU)...")
-        self.process = subprocess.Popen(
-            ffmpeg_cmd, 
-            stdout=subprocess.DEVNULL, 
-            stderr=subprocess.PIPE
-        )
-        
-        threading.Thread(target=self._monitor_ffmpeg, daemon=True).start()
+    def _ffmpeg_audio_args(self):
+        if self.bridge.audio_codec == AUDIO_PCMA:
+            # 音频: PCMA 透传 - 不解码、不经过滤镜，alaw 裸流按样本数生成时间戳
+            return ['-c:a', 'copy']
+        return [
+            # 音频: PCM (s16le) - 极低 CPU
+            # [关键] 使用 asetpts 根据样本计数重写时间戳，消除网络抖动带来的延迟
+            '-af', 'aresample=16000,asetpts=N/SR/TB',
 
-    def _monitor_ffmpeg(self):
-        if not self.process: return
-        for line in self.process.stderr:
+            '-c:a', 'pcm_s16le',
+            '-ar', '16000',     # 输出 16k 给 Go2RTC
+            '-ac', '1',
+        ]
+
+    async def _monitor_ffmpeg(self, process):
+        while True:
+            line = await process.stderr.readline()
+            if not line: break
             l = line.decode(errors='ignore').strip()
-            if "Error" in l:
-                logger.error(f"[FFmpeg] {l}")
+            if not self.published and l.startswith("Output #0"):
+                # 输出头写入成功，即 RTSP ANNOUNCE/SETUP/RECORD 已完成
+                self.published = True
+                self._published_at = time.monotonic()
+                elapsed = time.monotonic() - self._ffmpeg_start
+                self.bridge.timings["publish"].observe(elapsed)
+                logger.info(f"[{self.name}] RTSP publish established in {elapsed * 1000:.0f}ms")
+            elif "Error" in l:
+                logger.error(f"[{self.name}] [FFmpeg] {l}")
+
+    async def finish(self, timeout=FINISH_TIMEOUT) -> bool:
+        """输入结束 (回放完成): 写完队列后关闭输入，等待推流发出剩余数据后退出，不再重启，返回是否完整推送
+
+        ffmpeg 读到管道 EOF 后写完输出并退出；内置推流在发送缓冲清空后断开。超时未结束的由 stop() 终止。
+        """
+        self.finishing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            if self.bridge.publisher == PUBLISHER_NATIVE:
+                rtsp = self.rtsp
+                # 连接建立前 (或重连中) 数据仍在队列里，继续等待
+                if rtsp and rtsp.connected and not rtsp.video.queued_bytes and not rtsp.audio.queued_bytes \
+                        and not rtsp.transport.get_write_buffer_size():
+                    rtsp.close()
+                    return True
+            else:
+                # 推流建立 (Output #0) 时 ffmpeg 已打开两个 FIFO；在此之前关闭会删除管道，ffmpeg 找不到输入
+                if self.published:
+                    # ffmpeg 按时间戳交错读取两路输入，各自写完即关闭，先读到 EOF 的一路不再阻塞另一路
+                    for writer in (self.video_writer, self.audio_writer):
+                        if writer and writer.running and not writer.queued_bytes: writer.close()
+                if not self.process or self.process.returncode is not None: break
+            await asyncio.sleep(0.05)
+        else:
+            logger.warning(f"[{self.name}] Output did not finish within {timeout:g}s")
+            return False
+        code = self.process.returncode if self.process else None
+        if code != 0:
+            logger.error(f"[{self.name}] FFmpeg exited ({code}) before the output finished")
+        return code == 0
 
-    def _stop_ffmpeg(self):
-        if self.video_writer: self.video_writer.close()
-        if self.audio_writer: self.audio_writer.close()
+    async def stop(self):
+        self.published = False
+        for stream, writer in (("video", self.video_writer), ("audio", self.audio_writer)):
+            if not writer: continue
+            self.dropped[stream][0] += writer.dropped_frames
+            self.dropped[stream][1] += writer.dropped_bytes
+            writer.close()
+        self.video_writer = self.audio_writer = None
+        if self.rtsp:
+            self.rtsp.close()
+            self.rtsp = None
 
         if self.process:
-            self.process.terminate()
-            try: self.process.wait(timeout=2)
-            except: self.process.kill()
+            if self.process.returncode is None:
+                try: self.process.terminate()
+                except ProcessLookupError: pass
+            try: await asyncio.wait_for(self.process.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
             self.process = None
 
-    async def run_forever(self):
+    async def _run_ffmpeg(self):
+        """ffmpeg 与管道独立于 WS 会话，只在 ffmpeg 自身退出时重启
+
+        WS 短暂断开时 RTSP 推流保持不变，下游 (go2rtc/Frigate) 无需重连。
+        """
         while True:
+            try:
+                await self._start_ffmpeg()
+                await self._monitor_ffmpeg(self.process)
+                code = await self.process.wait()
+                # 退出码由 finish() 检查
+                if self.finishing: return
+                delay = self._restart_delay()
+                logger.warning(f"[{self.name}] FFmpeg exited ({code}), restarting in {delay:g}s...")
+            except Exception as e:
+                delay = self._restart_delay()
+                logger.error(f"[{self.name}] FFmpeg error: {e}")
+            self.restarts += 1
+            await self.stop()
+            await asyncio.sleep(delay)
+
+    async def _run_native(self):
+        """内置 RTSP 推流，不启动 ffmpeg 与 FIFO，连接断开时重新推流"""
+        while True:
+            bridge = self.bridge
+            self.rtsp = RTSPPublisher(self.rtsp_url, bridge.video_codec, self.name, bridge.param_sets, bridge.audio_codec, AUDIO_SAMPLE_RATE,
+                                      bridge.video_queue_bytes, bridge.audio_queue_bytes, bridge.drop_policy)
+            self.video_writer, self.audio_writer = self.rtsp.video, self.rtsp.audio
+            self._begin()
+            start = time.monotonic()
+            try:
+                await self.rtsp.connect()
+                self.published = True
+                self._published_at = time.monotonic()
+                elapsed = time.monotonic() - start
+                self.bridge.timings["publish"].observe(elapsed)
+                logger.info(f"[{self.name}] RTSP publish established in {elapsed * 1000:.0f}ms (native)")
+                await self.rtsp.wait_closed()
+                if self.finishing: return
+                delay = self._restart_delay()
+                logger.warning(f"[{self.name}] RTSP connection closed, reconnecting in {delay:g}s...")
+            except Exception as e:
+                delay = self._restart_delay()
+                logger.error(f"[{self.name}] RTSP publish error: {e!r}")
+            self.restarts += 1
+            await self.stop()
+            await asyncio.sleep(delay)
+
+    async def run(self):
+        await (self._run_native() if self.bridge.publisher == PUBLISHER_NATIVE else self._run_ffmpeg())
+
+    def write_video(self, payload, info, at=None):
+        blob = self.bridge._param_sets_blob
+        if info.keyframe and not info.param_sets and self._inject_param_sets and blob:
+            # 与关键帧合并为一项，RTP 输出时共用同一时间戳
+            payload = blob + payload
+        if self.video_writer.write(payload, keyframe=info.random_access, at=at) and info.random_access:
+            self._inject_param_sets = False
+
+    def _write_cached_gop(self):
+        """新的输出先送入缓存的 GOP，立即从最近的关键帧开始
+
+        输出的时间戳取写出时刻 (ffmpeg wallclock / RTP 墙上时间)，缓存的帧在启动时快速播放后追上实时，音频从实时数据开始。
+        """
+        cache = self.bridge.gop_cache
+        if not cache or not cache.items: return
+        for payload, info, at in cache.items: self.write_video(payload, info, at)
+        logger.info(f"[{self.name}] Started output from cached GOP: {len(cache.items)} frames, {cache.bytes // 1024} KB, "
+                    f"keyframe {(time.monotonic() - cache.keyframe_at) * 1000:.0f}ms old")
+
+    def write_audio(self, payload):
+        """按墙上时间校正音频时间轴后写入
+
+        ffmpeg 的 asetpts=N/SR/TB 与原生 RTP 输出都按样本数生成时间戳，而视频使用墙上时间。
+        WS 断开、队列满丢弃都会少样本，突发到达会多样本，不校正时音画偏差随运行时间无限增长。
+        """
+        writer = self.audio_writer
+        if not self.bridge.audio_sync:
+            writer.write(payload)
+            return
+        now = time.monotonic()
+        if writer is not self._audio_timeline:
+            # 新的输出从第一个音频样本开始计时
+            self._audio_timeline = writer
+            self._audio_anchor = now
+            self._audio_samples = 0
+        expected = int((now - self._audio_anchor) * AUDIO_SAMPLE_RATE)
+        drift = self._audio_samples - expected
+        self.audio_drift = drift / AUDIO_SAMPLE_RATE
+        if drift < -AUDIO_GAP_FILL * AUDIO_SAMPLE_RATE:
+            # 只补队列放得下的部分，其余等输出消费后再补，避免静音本身又被丢弃
+            size = min(-drift, writer.max_bytes - writer.queued_bytes - len(payload))
+            if size > 0:
+                self._log_audio_sync(now, f"Audio {-drift / AUDIO_SAMPLE_RATE:.2f}s behind, filling {size / AUDIO_SAMPLE_RATE:.2f}s with silence")
+                self._write_silence(writer, size)
+        elif drift > AUDIO_BURST_TRIM * AUDIO_SAMPLE_RATE:
+            # 丢弃最旧的样本，保留最新的音频
+            trim = min(drift, len(payload))
+            self._log_audio_sync(now, f"Audio {drift / AUDIO_SAMPLE_RATE:.2f}s ahead, trimming {trim / AUDIO_SAMPLE_RATE:.2f}s")
+            self.audio_trimmed += trim
+            payload = payload[trim:]
+        if payload and writer.write(payload):
+            self._audio_samples += len(payload)
+
+    def _log_audio_sync(self, now, message):
+        # 持续突发时每条消息都会裁剪，日志限频；累计量见 micam_audio_*_seconds_total
+        if now - self._audio_logged < 5: return
+        self._audio_logged = now
+        logger.info(f"[{self.name}] {message}")
+
+    def _write_silence(self, writer, size):
+        chunk = bytes([ALAW_SILENCE]) * 3200
+        while size > 0:
+            data = memoryview(chunk)[:min(size, len(chunk))]
+            if not writer.write(data): break
+            self._audio_samples += len(data)
+            self.audio_filled += len(data)
+            size -= len(data)
+
+    def status(self) -> dict:
+        writer = self.video_writer
+        return {
+            "url": redact_url(self.rtsp_url),
+            "running": self.running,
+            "restarts": self.restarts,
+            "queue_bytes": writer.queued_bytes if writer else 0,
+            "dropped_frames": self.dropped["video"][0] + (writer.dropped_frames if writer else 0),
+        }
+
+    def metrics(self, cam):
+        """本输出的队列、丢弃、音频校正与运行状态，按 output 序号区分"""
+        out = {**cam, "output": str(self.index)}
+        for stream, writer in (("video", self.video_writer), ("audio", self.audio_writer)):
+            labels = {**out, "stream": stream}
+            yield "micam_dropped_frames_total", "counter", "Frames dropped by the output queue", labels, \
+                self.dropped[stream][0] + (writer.dropped_frames if writer else 0)
+            yield "micam_dropped_bytes_total", "counter", "Bytes dropped by the output queue", labels, \
+                self.dropped[stream][1] + (writer.dropped_bytes if writer else 0)
+            yield "micam_queue_items", "gauge", "Items waiting in the output queue", labels, len(writer.queue) if writer else 0
+            yield "micam_queue_bytes", "gauge", "Bytes waiting in the output queue", labels, writer.queued_bytes if writer else 0
+        yield "micam_audio_drift_seconds", "gauge", "Audio timeline offset against wall clock before correction (positive: ahead)", out, \
+            self.audio_drift
+        yield "micam_audio_filled_seconds_total", "counter", "Silence inserted to close audio gaps", out, self.audio_filled / AUDIO_SAMPLE_RATE
+        yield "micam_audio_trimmed_seconds_total", "counter", "Audio trimmed from bursts ahead of the wall clock", out, \
+            self.audio_trimmed / AUDIO_SAMPLE_RATE
+        yield "micam_ffmpeg_restarts_total", "counter", "ffmpeg process (or native RTSP publisher) restarts", out, self.restarts
+        yield "micam_output_stalls_total", "counter", "Outputs restarted for not consuming queued video", out, self.stalls
+        yield "micam_ffmpeg_running", "gauge", "Whether the ffmpeg process (or native RTSP publisher) is running", out, int(self.running)
+
+class RTSPBridge:
+    def __init__(self, base_url, username, password, camera_id, rtsp_url, video_codec, channel, video_quality, name=None, session_pool=None,
+                 drop_policy=DROP_KEYFRAME, video_queue_bytes=2 * 1024 * 1024, audio_queue_bytes=64 * 1024, publisher=PUBLISHER_FFMPEG,
+                 audio_codec=AUDIO_L16, audio_level=False, audio_threshold=None, event_sink=None,
+                 activity=False, activity_threshold=None, gop_cache_bytes=1024 * 1024,
+                 sub_rtsp_url=None, sub_video_quality="1", sub_channel=None, sub_on_demand_url=None,
+                 on_demand=False, on_demand_url=None, idle_timeout=30.0, consumer_monitor=None, stall_factor=STALL_FACTOR,
+                 stall_min=STALL_MIN):
+        if publisher not in PUBLISHERS:
+            raise ValueError(f"Unknown publisher: {publisher}")
+        if audio_codec not in AUDIO_CODECS:
+            raise ValueError(f"Unknown audio codec: {audio_codec}")
+        if video_codec not in VIDEO_CODECS:
+            raise ValueError(f"Unknown video codec: {video_codec}")
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.camera_id = camera_id
+        self.channel = str(channel)
+        self.video_quality = str(video_quality)
+        # auto 时为 None，识别出编码后才启动输出 (ffmpeg 的 demuxer 与原生 RTP 打包都取决于编码)
+        self.video_codec = None if video_codec == VIDEO_CODEC_AUTO else video_codec
+        self._undetected = 0
+        # 可以是多个地址 (列表或逗号分隔)，共用同一个 WS 分别推流
+        urls = rtsp_url.split(",") if isinstance(rtsp_url, str) else rtsp_url
+        self.rtsp_urls = [url.strip() for url in urls if url.strip()]
+        if not self.rtsp_urls:
+            raise ValueError("rtsp_url is required")
+        self.rtsp_url = self.rtsp_urls[0]
+        # 多摄像头模式下用于区分日志与管道，同一摄像头的不同通道需指定不同 name
+        self.name = str(name or camera_id)
+        # 同一 Miloco 的摄像头共享会话与登录，未指定时每个摄像头独立一个
+        self.session_pool = session_pool or SessionPool()
+        self.publisher = publisher
+        # RTSP 音频输出: l16 解码为 16 位 PCM，pcma 直接透传 G.711A (带宽减半)
+        self.audio_codec = audio_codec
+        # 声音、画面活动等事件的输出 (日志/webhook)，多摄像头共享
+        self.event_sink = event_sink or EventSink()
+        # 音量统计: 开启 audio_level 或设置了阈值 (dBFS) 时在接收路径上解码 A-law 计算 RMS/峰值
+        self.audio_meter: Optional[AudioLevel] = None
+        if audio_level or audio_threshold is not None:
+            self.audio_meter = AudioLevel(AUDIO_SAMPLE_RATE, threshold=audio_threshold, on_event=self._emit_event)
+        # 画面活动: 按 P 帧大小相对基线的比例估计，阈值为倍数 (如 2.0)
+        self.activity: Optional[VideoActivity] = None
+        if activity or activity_threshold is not None:
+            self.activity = VideoActivity(activity_threshold, on_event=self._emit_event)
+        
+        # 每路输出的队列按字节限制: 视频约数秒码流，音频 (16k G.711A) 约 4 秒
+        self.drop_policy = drop_policy
+        self.video_queue_bytes = int(video_queue_bytes)
+        self.audio_queue_bytes = int(audio_queue_bytes)
+        self.outputs = [RTSPOutput(self, url, i) for i, url in enumerate(self.rtsp_urls)]
+        # 最近一个 GOP 的缓存，新的输出 (启动、重启、识别出编码后) 立即从最近的关键帧开始，0 表示不缓存。
+        # 不超过视频队列的一半: 送入新输出时整个 GOP 须放得下，并为随后到达的实时帧留出空间，否则溢出丢弃整个缓存
+        self.gop_cache = GopBuffer(min(int(gop_cache_bytes), self.video_queue_bytes // 2)) if gop_cache_bytes else None
+        # 最近一次的 VPS/SPS/PPS，重启后插入到第一个关键帧之前，解码器无需等待带内参数集
+        self.param_sets = {}
+        self._param_sets_blob = b""
+        # 由 SPS (HEVC 另参考 VPS) 解析出的码流信息，与实测的帧率、码率、GOP 一起由 status() 导出
+        self.stream_info: Optional[nal.StreamInfo] = None
+        self.stream_stats = StreamStats()
+        # 运行统计，由 metrics() 导出
+        self.received = {"video": [0, 0], "audio": [0, 0]} # [消息数, 字节数]
+        self.reconnects = 0
+        self.connected_at = 0.0
+        # 卡顿检测: 帧间隔超过实测帧间隔的 stall_factor 倍时重连，0 表示只依赖 WS 的读超时 (20 秒)
+        self.stall_factor = float(stall_factor)
+        self.stall_min = float(stall_min)
+        self.stalls = 0
+        self._last_video_at = 0.0
+        self._fast_reconnect = False
+        # 启动耗时: 会话各阶段，以及 ffmpeg 启动到 RTSP 推流建立 (publish)
+        self.timings = {phase: Histogram() for phase in SESSION_PHASES + ("publish",)}
+        self._session_start = 0.0
+        self._session_marks = {}
+        # 按墙上时间校正各输出的音频时间轴，非原速回放时关闭
+        self.audio_sync = True
+        # 录制模式下记录收到的每条 WS 消息
+        self.recorder: Optional[CaptureWriter] = None
+        # 按需推流: 只在 RTSP 服务器上有观看者时连接 WS 与启动输出，观看者离开 idle_timeout 秒后断开。
+        # 观看者数量默认从推流地址推导的 go2rtc 接口查询
+        self.on_demand = bool(on_demand)
+        self.on_demand_url = on_demand_url or go2rtc_streams_url(self.rtsp_url)
+        self.idle_timeout = float(idle_timeout)
+        self.consumer_monitor = consumer_monitor or (ConsumerMonitor() if on_demand else None)
+        self.consumers = 0
+        self.on_demand_starts = 0
+        self._stream_task: Optional[asyncio.Task] = None
+        # 子码流: 同一摄像头的另一个 video_quality (或通道)，共用会话与事件输出，推流到另一个地址，
+        # 如 NVR 的录像流 + 检测流。音量、画面活动只在主码流上统计
+        self.main_stream: Optional[RTSPBridge] = None
+        self.sub_stream: Optional[RTSPBridge] = None
+        if sub_rtsp_url:
+            # 子码流观看者接口未指定时，主码流使用自定义接口则沿用 (非 go2rtc 时无法推导)，否则由子码流地址推导
+            sub_on_demand_url = sub_on_demand_url or on_demand_url
+            self.sub_stream = RTSPBridge(base_url, username, password, camera_id, sub_rtsp_url, video_codec,
+                                         channel if sub_channel is None else sub_channel, sub_video_quality, name=f"{self.name}_sub",
+                                         session_pool=self.session_pool, drop_policy=drop_policy, video_queue_bytes=video_queue_bytes,
+                                         audio_queue_bytes=audio_queue_bytes, publisher=publisher, audio_codec=audio_codec,
+                                         event_sink=self.event_sink, gop_cache_bytes=gop_cache_bytes,
+                                         on_demand=on_demand, on_demand_url=sub_on_demand_url, idle_timeout=idle_timeout,
+                                         consumer_monitor=self.consumer_monitor,
+                                         stall_factor=stall_factor, stall_min=stall_min)
+            self.sub_stream.main_stream = self
+
+    @property
+    def streams(self):
+        """本摄像头的所有码流 (主码流与可选的子码流)，用于指标与状态"""
+        return [self] + ([self.sub_stream] if self.sub_stream else [])
+
+    async def _run_output(self):
+        if not self.video_codec:
+            logger.info(f"[{self.name}] Waiting for parameter sets to detect the video codec...")
+            while not self.video_codec: await asyncio.sleep(0.05)
+        await asyncio.gather(*(output.run() for output in self.outputs))
+
+    async def _stop_output(self):
+        for output in self.outputs: await output.stop()
+
+    async def _run_sessions(self):
+        while True:
+            if self.main_stream: await self._wait_main_stream()
             try:
                 await self.run_session()
             except Exception as e:
-                logger.error(f"Session error: {e}")
-            logger.info("Restarting bridge in 3s...")
-            self._stop_ffmpeg()
+                logger.error(f"[{self.name}] Session error: {e}")
+            self.reconnects += 1
+            if self._fast_reconnect:
+                self._fast_reconnect = False
+                logger.info(f"[{self.name}] Reconnecting WS now...")
+                continue
+            logger.info(f"[{self.name}] Reconnecting WS in 3s...")
             await asyncio.sleep(3)
 
+    async def _wait_main_stream(self):
+        """子码流在主码流连接后再连接
+
+        两路不同时向 Miloco 打开，摄像头离线或登录失效时只由主码流按间隔重试，子码流随后跟上。
+        按需推流时主码流没有观看者则不等待。
+        """
+        main = self.main_stream
+        if main.connected_at or not main.streaming: return
+        logger.info(f"[{self.name}] Waiting for main stream {main.name}...")
+        while not main.connected_at and main.streaming: await asyncio.sleep(0.1)
+
+    @property
+    def streaming(self) -> bool:
+        """WS 会话与输出是否在运行 (未开启按需推流时始终运行)"""
+        return not self.on_demand or self._stream_task is not None
+
+    async def _stream(self):
+        output_task = asyncio.ensure_future(self._run_output())
+        try:
+            await self._run_sessions()
+        finally:
+            output_task.cancel()
+            await asyncio.gather(output_task, return_exceptions=True)
+            await self._stop_output()
+            # 按需推流停止后 GOP 与码流统计都已过时，再次启动时从新的数据开始
+            if self.gop_cache: self.gop_cache.clear()
+            self.stream_stats.reset()
+
+    async def _run_on_demand(self):
+        """按观看者数量启动、停止 WS 会话与输出
+
+        观看者离开后保持推流 idle_timeout 秒，其间回来的观看者直接使用仍在推流的输出。
+        重新启动时输出与 WS 连接并行启动，编码已知时输出无需等待识别，
+        输出启动期间到达的关键帧由 GOP 缓存补入，推流从 WS 的第一个关键帧开始。
+        """
+        logger.info(f"[{self.name}] On-demand mode, watching consumers at {self.on_demand_url}")
+        idle_since = 0.0
+        try:
+            while True:
+                consumers = await self.consumer_monitor.count(self.on_demand_url)
+                # 查询失败时保持当前状态
+                if consumers is not None: self.consumers = consumers
+                now = time.monotonic()
+                if consumers:
+                    idle_since = 0.0
+                    if not self._stream_task:
+                        logger.info(f"[{self.name}] {consumers} consumer(s), starting stream")
+                        self.on_demand_starts += 1
+                        self._stream_task = asyncio.ensure_future(self._stream())
+                elif consumers == 0 and self._stream_task:
+                    if not idle_since:
+                        idle_since = now
+                    elif now - idle_since >= self.idle_timeout:
+                        logger.info(f"[{self.name}] No consumers for {self.idle_timeout:g}s, stopping stream")
+                        await self._stop_stream()
+                        idle_since = 0.0
+                await asyncio.sleep(ON_DEMAND_POLL)
+        finally:
+            await self._stop_stream()
+
+    async def _stop_stream(self):
+        task, self._stream_task = self._stream_task, None
+        if not task: return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def run_forever(self):
+        # 子码流与主码流一起启动、一起停止
+        sub_task = asyncio.ensure_future(self.sub_stream.run_forever()) if self.sub_stream else None
+        try:
+            await (self._run_on_demand() if self.on_demand else self._stream())
+        finally:
+            if sub_task:
+                sub_task.cancel()
+                await asyncio.gather(sub_task, return_exceptions=True)
+
+    async def capture(self, path, duration=0.0):
+        """只录制 WS 消息到文件，不启动 ffmpeg；duration 为 0 时一直录制"""
+        self.recorder = CaptureWriter(path, camera_id=self.camera_id, channel=self.channel,
+                                      video_quality=self.video_quality, video_codec=self.video_codec or VIDEO_CODEC_AUTO)
+        logger.info(f"[{self.name}] Capturing to {path}")
+        try:
+            await asyncio.wait_for(self._run_sessions(), duration or None)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.recorder.close()
+            self.recorder = None
+            logger.info(f"[{self.name}] Captured {sum(s[0] for s in self.received.values())} messages")
+
+    async def replay(self, reader: CaptureReader, speed=1.0) -> bool:
+        """把录制的消息送入 PipeWriter 与 ffmpeg
+
+        speed 为回放倍速，0 表示不按时间戳等待，以队列为背压尽快送入，用于压测处理链路。返回所有输出是否完整推送。
+        """
+        # 非原速回放时录制的时间戳与墙上时间不一致，不按墙上时间校正音频
+        self.audio_sync = speed == 1
+        output_task = asyncio.ensure_future(self._run_output())
+        try:
+            self._session_start = time.monotonic()
+            self._session_marks = {}
+            self._arm_first_write()
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            for ts, data in reader:
+                # 编码未知时先送入消息识别编码，识别后等待输出启动 (期间的数据暂存后送入)
+                while self.video_codec and not all(o.video_writer for o in self.outputs): await asyncio.sleep(0.01)
+                if speed:
+                    delay = start + ts / speed - loop.time()
+                    if delay > 0: await asyncio.sleep(delay)
+                else:
+                    # 只对视频背压: ffmpeg 按时间戳交错读取两路输入，音频超前时不会读取音频管道，
+                    # 等待音频会与 ffmpeg 互相等待；音频超出队列的部分照常丢弃
+                    while self._video_backlog() > self.video_queue_bytes // 2: await asyncio.sleep(0.005)
+                    await asyncio.sleep(0)
+                # 与 aiohttp 收到的消息一样为 bytes，同时不再引用 mmap
+                self._on_message(bytes(data))
+            # 输出推送完已送入的数据后再结束，FIFO 与 ffmpeg 中的数据不丢失
+            finished = await asyncio.gather(*(output.finish() for output in self.outputs))
+            if not all(finished):
+                logger.error(f"[{self.name}] Replay failed: {finished.count(False)} of {len(finished)} output(s) did not finish")
+                return False
+            logger.info(f"[{self.name}] Replayed {len(reader)} messages in {loop.time() - start:.2f}s")
+            return True
+        finally:
+            output_task.cancel()
+            await asyncio.gather(output_task, return_exceptions=True)
+            await self._stop_output()
+
+    def _video_backlog(self) -> int:
+        """各输出中最大的视频积压，回放按最慢的输出背压"""
+        return max(o.video_writer.queued_bytes if o.video_writer else 0 for o in self.outputs)
+
     async def run_session(self):
-        self._start_ffmpeg()
-        jar = aiohttp.CookieJar(unsafe=True)
-        timeout = aiohttp.ClientTimeout(total=None, connect=10, sock_read=20)
+        # 沿用已在运行的 ffmpeg: 视频从下一个关键帧继续，音频在下一条消息到达时按时间轴补齐断开期间的静音
+        for output in self.outputs: output.resync()
+        self._session_start = time.monotonic()
+        self._session_marks = {}
+        self.stream_stats.reset()
+        self._last_video_at = 0.0
+        self._arm_first_write()
+        miloco = self.session_pool.get(self.base_url, self.username, self.password)
+        if not await miloco.login():
+            raise ConnectionError("Login failed")
+        self._mark("login")
 
-        async with aiohttp.ClientSession(cookie_jar=jar, timeout=timeout) as session:
-            if not await self._login(session): return
+        protocol = "wss" if self.base_url.startswith("https") else "ws"
+        host = self.base_url.split("://")[1]
+        ws_url = f"{protocol}://{host}/api/miot/ws/video_stream?camera_id={self.camera_id}&channel={self.channel}&video_quality={self.video_quality}"
+        
+        logger.info(f"[{self.name}] Connecting to WS: {ws_url}")
+        try:
+            async with await miloco.ws_connect(ws_url, heartbeat=15.0) as ws:
+                self._mark("ws_connect")
+                self.connected_at = time.monotonic()
+                logger.info(f"[{self.name}] WebSocket Connected! Streaming...")
+                # 卡顿时取消接收任务: 正常关闭要等待对端回应 (最长 10 秒)，取消后 aiohttp 直接断开连接
+                tasks = [asyncio.ensure_future(self._receive(ws))]
+                if self.stall_factor: tasks.append(asyncio.ensure_future(self._watchdog()))
+                try:
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in tasks: task.cancel()
+                    results = await asyncio.gather(*tasks, return_exceptions=True)
+                if isinstance(results[0], Exception): raise results[0]
+        finally:
+            self.connected_at = 0.0
+            # 断开前的 GOP 与之后的数据不连续，重连期间 (如子码流等待主码流) 重启的输出不再送入
+            if self.gop_cache: self.gop_cache.clear()
+            self._disarm_first_write()
+            if "first_write" not in self._session_marks: self._log_timings()
 
-            protocol = "wss" if self.base_url.startswith("https") else "ws"
-            host = self.base_url.split("://")[1]
-            ws_url = f"{protocol}://{host}/api/miot/ws/video_stream?camera_id={self.camera_id}&channel={self.channel}&video_quality={self.video_quality}"
-            
-            logger.info(f"Connecting to WS: {ws_url}")
-            async with session.ws_connect(ws_url, ssl=False, heartbeat=15.0) as ws:
-                logger.info("WebSocket Connected! Streaming...")
-                
-                async for msg in ws:
-                    if msg.type == aiohttp.WSMsgType.BINARY:
-                        data = msg.data
-                        if len(data) > 1:
-                            p_type = data[0]
-                            payload = data[1:]
-                            if p_type == 1: self.video_writer.write(payload)
-                            elif p_type == 2: self.audio_writer.write(payload)
-                    elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
-                        logger.info("WS Closed")
-                        break
+    async def _receive(self, ws):
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                if self.recorder: self.recorder.write(msg.data)
+                self._on_message(msg.data)
+            elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                logger.info(f"[{self.name}] WS Closed")
+                break
+
+    async def _watchdog(self):
+        """按实测帧率检测视频停止到达 (WS 仍然连接) 与输出停止消费，视频卡顿时返回
+
+        帧率未知 (会话刚开始、还没有两帧) 时不判断视频卡顿，由 WS 读超时兜底。
+        """
+        while True:
+            await asyncio.sleep(STALL_CHECK)
+            now = time.monotonic()
+            fps = self.stream_stats.fps
+            limit = max(self.stall_factor / fps, self.stall_min) if fps else 0.0
+            for output in self.outputs:
+                if not output.consuming(now, max(limit, OUTPUT_STALL_MIN)):
+                    logger.warning(f"[{output.name}] Output stalled: {output.video_writer.queued_bytes} bytes queued, "
+                                   f"nothing written for {now - output._progress_at:.1f}s, restarting")
+                    output.abort()
+            if not limit or not self._last_video_at: continue
+            idle = now - self._last_video_at
+            if idle > limit:
+                logger.warning(f"[{self.name}] Stream stalled: no video for {idle:.2f}s "
+                               f"(limit {limit:.2f}s at {fps:.1f}fps), reconnecting")
+                self.stalls += 1
+                self._fast_reconnect = True
+                return
+
+    def _mark(self, phase):
+        """记录本次会话某阶段的耗时，每个阶段只记录第一次"""
+        if phase in self._session_marks: return
+        elapsed = time.monotonic() - self._session_start
+        self._session_marks[phase] = elapsed
+        self.timings[phase].observe(elapsed)
+
+    def _arm_first_write(self, writer=None):
+        """在输出的视频队列上记录本次会话的 first_write (任一输出第一次写出)，writer 为空时为所有输出"""
+        if not self._session_start or "first_write" in self._session_marks: return
+        for w in [writer] if writer else [o.video_writer for o in self.outputs]:
+            if w: w.on_write = self._on_first_write
+
+    def _disarm_first_write(self):
+        for output in self.outputs:
+            if output.video_writer: output.video_writer.on_write = None
+
+    def _on_first_write(self):
+        self._disarm_first_write()
+        self._mark("first_write")
+        self._log_timings()
+
+    def _log_timings(self):
+        marks = " ".join(f"{p}={self._session_marks[p] * 1000:.0f}ms" for p in SESSION_PHASES if p in self._session_marks)
+        logger.info(f"[{self.name}] Session timings: {marks or 'none'}")
+
+    def _on_message(self, data):
+        """分发一条 WS 二进制消息: 第 1 字节为类型 (1 视频 / 2 音频)，其余为负载"""
+        if len(data) > 1:
+            if "first_message" not in self._session_marks: self._mark("first_message")
+            p_type = data[0]
+            # memoryview 切片直接引用原消息，关键帧可达数百 KB，避免逐帧复制
+            payload = memoryview(data)[1:]
+            if p_type == 1:
+                stat = self.received["video"]
+                stat[0] += 1
+                stat[1] += len(payload)
+                self._last_video_at = time.monotonic()
+                if not self.video_codec and not self._detect_codec(data): return
+                # 关键帧或参数集可以作为丢帧后的恢复点
+                info = nal.classify(data, self.video_codec, 1)
+                if info.keyframe and "first_keyframe" not in self._session_marks: self._mark("first_keyframe")
+                if info.param_sets: self._update_param_sets(data)
+                if info.vcl:
+                    self.stream_stats.feed(len(payload), info.keyframe)
+                    if self.activity: self.activity.feed(len(payload), info.keyframe)
+                if self.gop_cache: self.gop_cache.add_video(payload, info)
+                for output in self.outputs:
+                    if output.video_writer: output.write_video(payload, info)
+            elif p_type == 2:
+                stat = self.received["audio"]
+                stat[0] += 1
+                stat[1] += len(payload)
+                if self.audio_meter: self.audio_meter.feed(payload)
+                for output in self.outputs:
+                    if output.audio_writer: output.write_audio(payload)
+
+    def _detect_codec(self, data) -> bool:
+        codec = nal.detect_codec(data, 1)
+        if not codec:
+            self._undetected += 1
+            if self._undetected == 300:
+                logger.warning(f"[{self.name}] No parameter sets in the first {self._undetected} video messages, "
+                               f"set video_codec explicitly if the codec cannot be detected")
+            return False
+        self.video_codec = codec
+        logger.info(f"[{self.name}] Detected video codec: {codec}")
+        return True
+
+    def _update_param_sets(self, data):
+        found = nal.param_sets(data, self.video_codec, 1)
+        if not found: return
+        sps_type = nal.HEVC_SPS if self.video_codec == nal.HEVC else nal.H264_SPS
+        sps_changed = sps_type in found and found[sps_type] != self.param_sets.get(sps_type)
+        self.param_sets.update(found)
+        # 按类型排序即为 VPS/SPS/PPS (H.264 为 SPS/PPS) 的解码顺序
+        self._param_sets_blob = nal.annexb(self.param_sets[t] for t in sorted(self.param_sets))
+        if sps_changed: self._update_stream_info()
+
+    def _update_stream_info(self):
+        """参数集每个关键帧都会重复，只在 SPS 变化时解析"""
+        try:
+            info = nal.parse_sps(self.param_sets[nal.HEVC_SPS if self.video_codec == nal.HEVC else nal.H264_SPS], self.video_codec)
+            if not info.fps and nal.HEVC_VPS in self.param_sets and self.video_codec == nal.HEVC:
+                info = info._replace(fps=nal.parse_vps_fps(self.param_sets[nal.HEVC_VPS]))
+        except ValueError as e:
+            logger.warning(f"[{self.name}] Failed to parse SPS: {e}")
+            return
+        if info == self.stream_info: return
+        self.stream_info = info
+        fps = f" {info.fps:g}fps" if info.fps else ""
+        logger.info(f"[{self.name}] Stream: {info.codec} {info.profile}@L{info.level} {info.width}x{info.height}{fps}")
+
+    def status(self) -> dict:
+        """当前连接与码流状态，由 /status 以 JSON 导出"""
+        info, stats = self.stream_info, self.stream_stats
+        return {
+            "name": self.name,
+            "camera_id": self.camera_id,
+            "channel": self.channel,
+            "video_quality": self.video_quality,
+            "publisher": self.publisher,
+            "connected": bool(self.connected_at),
+            "uptime": round(time.monotonic() - self.connected_at, 1) if self.connected_at else 0.0,
+            "reconnects": self.reconnects,
+            "stalls": self.stalls,
+            "streaming": self.streaming,
+            "consumers": self.consumers if self.on_demand else None,
+            "stream": {
+                "codec": self.video_codec or VIDEO_CODEC_AUTO,
+                "profile": info.profile if info else None,
+                "level": info.level if info else None,
+                "width": info.width if info else None,
+                "height": info.height if info else None,
+                "declared_fps": info.fps if info else None,
+                "fps": round(stats.fps, 2),
+                "bitrate_kbps": round(stats.bitrate / 1000, 1),
+                "gop_frames": stats.gop_frames,
+                "gop_seconds": round(stats.gop_seconds, 2),
+            },
+            "outputs": [output.status() for output in self.outputs],
+        }
+
+    def _emit_event(self, event, **fields):
+        self.event_sink.emit(self.name, event, **fields)
+
+    def metrics(self):
+        """导出本摄像头的指标样本: (名称, 类型, 说明, 标签, 值)"""
+        cam = {"camera": self.name}
+        for stream in ("video", "audio"):
+            labels = {**cam, "stream": stream}
+            yield "micam_received_messages_total", "counter", "WebSocket messages received", labels, self.received[stream][0]
+            yield "micam_received_bytes_total", "counter", "WebSocket payload bytes received", labels, self.received[stream][1]
+        for output in self.outputs:
+            yield from output.metrics(cam)
+        if self.audio_meter:
+            meter = self.audio_meter
+            yield "micam_audio_rms_dbfs", "gauge", "Audio RMS level of the last analysis window", cam, meter.rms
+            yield "micam_audio_peak_dbfs", "gauge", "Audio peak level of the last analysis window", cam, meter.peak
+            yield "micam_sound_active", "gauge", "Whether the audio level is above the event threshold", cam, int(meter.active)
+            yield "micam_sound_events_total", "counter", "Sound events (level crossing the threshold)", cam, meter.events
+        if self.activity:
+            activity = self.activity
+            yield "micam_activity_score", "gauge", "Recent P-frame size relative to the rolling baseline", cam, activity.score
+            yield "micam_activity_baseline_bytes", "gauge", "Rolling baseline of P-frame sizes", cam, activity.baseline
+            yield "micam_activity_active", "gauge", "Whether the activity score is above the event threshold", cam, int(activity.active)
+            yield "micam_activity_events_total", "counter", "Activity events (score crossing the threshold)", cam, activity.events
+        stats = self.stream_stats
+        yield "micam_video_fps", "gauge", "Measured video frame rate", cam, stats.fps
+        yield "micam_video_bitrate_bps", "gauge", "Measured video bitrate", cam, stats.bitrate
+        yield "micam_video_gop_frames", "gauge", "Frames between the last two keyframes", cam, stats.gop_frames
+        yield "micam_video_gop_seconds", "gauge", "Seconds between the last two keyframes", cam, stats.gop_seconds
+        if self.stream_info:
+            info = self.stream_info
+            yield "micam_video_info", "gauge", "Stream parameters parsed from the SPS", \
+                {**cam, "codec": info.codec, "profile": info.profile, "level": info.level,
+                 "width": info.width, "height": info.height}, 1
+        if self.gop_cache:
+            cache = self.gop_cache
+            yield "micam_gop_cache_bytes", "gauge", "Bytes held in the GOP cache", cam, cache.bytes
+            yield "micam_gop_cache_age_seconds", "gauge", "Age of the cached keyframe", cam, \
+                time.monotonic() - cache.keyframe_at if cache.keyframe_at else 0.0
+            yield "micam_gop_cache_overflows_total", "counter", "GOPs discarded for exceeding the cache size", cam, cache.overflows
+        if self.on_demand:
+            yield "micam_consumers", "gauge", "Consumers of the RTSP stream reported by the RTSP server", cam, self.consumers
+            yield "micam_streaming", "gauge", "Whether the on-demand stream is running", cam, int(self.streaming)
+            yield "micam_on_demand_starts_total", "counter", "Streams started on demand", cam, self.on_demand_starts
+        yield "micam_reconnects_total", "counter", "WebSocket sessions that ended and were reconnected", cam, self.reconnects
+        yield "micam_stalls_total", "counter", "WebSocket sessions reconnected because video stopped arriving", cam, self.stalls
+        yield "micam_session_uptime_seconds", "gauge", "Seconds since the current WebSocket session connected", cam, \
+            time.monotonic() - self.connected_at if self.connected_at else 0.0
+        for phase, hist in self.timings.items():
+            yield "micam_startup_phase_seconds", "histogram", "Time from session (or ffmpeg) start to each start-up phase", \
+                {**cam, "phase": phase}, hist
+
+def load_cameras(path, defaults):
+    """读取多摄像头配置文件，返回每个摄像头的 RTSPBridge 参数
+
+    文件为 JSON，可以是摄像头列表，也可以是 {"cameras": [...], ...}，
+    顶层的其他字段作为所有摄像头的公共参数。
+    """
+    with open(path, encoding="utf-8") as f:
+        conf = json.load(f)
+    if isinstance(conf, list):
+        conf = {"cameras": conf}
+    common = {**defaults, **{k: v for k, v in conf.items() if k != "cameras"}}
+    cameras, names = [], set()
+    for cam in conf.get("cameras", []):
+        params = {**common, **cam}
+        if not params.get("camera_id") or not params.get("rtsp_url"):
+            raise ValueError(f"camera_id and rtsp_url are required: {cam}")
+        name = str(params.get("name") or params["camera_id"])
+        for n in [name, f"{name}_sub"] if params.get("sub_rtsp_url") else [name]:
+            if n in names:
+                raise ValueError(f"Duplicate camera name: {n}")
+            names.add(n)
+        cameras.append(params)
+    return cameras
+
+async def run_bridges(bridges, metrics_port=0, metrics_host="0.0.0.0"):
+    """在同一个事件循环中运行多个摄像头，每个摄像头独立重连"""
+    server = MetricsServer(bridges, metrics_host, metrics_port) if metrics_port else None
+    try:
+        if server: await server.start()
+        await asyncio.gather(*(bridge.run_forever() for bridge in bridges))
+    finally:
+        if server: await server.stop()
+        for pool in {id(b.session_pool): b.session_pool for b in bridges}.values():
+            await pool.close()
+        for sink in {id(b.event_sink): b.event_sink for b in bridges}.values():
+            await sink.close()
+        for monitor in {id(b.consumer_monitor): b.consumer_monitor for b in bridges if b.consumer_monitor}.values():
+            await monitor.close()
+
+async def run_capture(bridge, path, duration=0.0):
+    try:
+        await bridge.capture(path, duration)
+    finally:
+        await bridge.session_pool.close()
+        await bridge.event_sink.close()
+
+async def run_replay(bridge, reader, speed=1.0) -> bool:
+    try:
+        return await bridge.replay(reader, speed)
+    finally:
+        await bridge.event_sink.close()
 
 def main():
     parser = argparse.ArgumentParser()
+    # run: 转发 (默认) / capture: 录制 WS 消息到文件 / replay: 把录制文件送入 ffmpeg 推流
+    parser.add_argument("mode", nargs="?", default="run", choices=("run", "capture", "replay"))
+    parser.add_argument("file", nargs="?", help="capture file for capture/replay")
+    parser.add_argument("--duration", type=float, default=0.0, help="capture duration in seconds (0: until interrupted)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor (0: as fast as possible)")
     parser.add_argument("--base-url", default=os.getenv("MILOCO_BASE_URL", "http://127.0.0.1:8000"))
     parser.add_argument("--username", default="admin")
     parser.add_argument("--password", default=os.getenv("MILOCO_PASSWORD", ""))
     parser.add_argument("--camera-id", default=os.getenv("CAMERA_ID", ""))
     # 确保这里的 IP 是你 HAOS 的 IP
     parser.add_argument("--rtsp-url", default=os.getenv("RTSP_URL", "rtsp://127.0.0.1:8554/stream1"))
-    parser.add_argument("--video-quality", default="2")
+    parser.add_argument("--video-quality", default=os.getenv("VIDEO_QUALITY", "2"))
+    # 视频编码: auto 根据码流中的参数集自动识别
+    parser.add_argument("--video-codec", default=os.getenv("VIDEO_CODEC", VIDEO_CODEC_AUTO), choices=VIDEO_CODECS)
+    parser.add_argument("--channel", default=os.getenv("STREAM_CHANNEL", "0"))
+    # 子码流 (如 NVR 检测流): 同一摄像头的另一个 video_quality 推流到另一个地址，共用会话
+    parser.add_argument("--sub-rtsp-url", default=os.getenv("SUB_RTSP_URL", ""))
+    parser.add_argument("--sub-video-quality", default=os.getenv("SUB_VIDEO_QUALITY", "1"))
+    parser.add_argument("--sub-channel", default=os.getenv("SUB_STREAM_CHANNEL"))
+    # 按需推流: 只在 RTSP 服务器上有观看者时连接摄像头，观看者数量默认查询 go2rtc 的 /api/streams
+    parser.add_argument("--on-demand", action="store_true", default=os.getenv("ON_DEMAND", "") not in ("", "0"))
+    parser.add_argument("--on-demand-url", default=os.getenv("ON_DEMAND_URL", ""))
+    parser.add_argument("--sub-on-demand-url", default=os.getenv("SUB_ON_DEMAND_URL", ""))
+    parser.add_argument("--idle-timeout", type=float, default=float(os.getenv("IDLE_TIMEOUT", "30")))
+    # 卡顿检测: 帧间隔超过实测帧间隔的倍数 (且不少于 stall-min 秒) 时立即重连，0 表示关闭
+    parser.add_argument("--stall-factor", type=float, default=float(os.getenv("STALL_FACTOR", str(STALL_FACTOR))))
+    parser.add_argument("--stall-min", type=float, default=float(os.getenv("STALL_MIN", str(STALL_MIN))))
+    # 多摄像头配置文件 (JSON)，指定后忽略 --camera-id / --rtsp-url
+    parser.add_argument("--config", default=os.getenv("MICAM_CONFIG", ""))
+    # 视频队列溢出策略: newest 丢新数据 / oldest 丢旧数据 / keyframe 丢到下一个关键帧
+    parser.add_argument("--drop-policy", default=os.getenv("DROP_POLICY", DROP_KEYFRAME), choices=DROP_POLICIES)
+    # 推流方式: ffmpeg 子进程，或内置 RTSP 客户端 (native，不启动 ffmpeg)
+    parser.add_argument("--publisher", default=os.getenv("PUBLISHER", PUBLISHER_FFMPEG), choices=PUBLISHERS)
+    # RTSP 音频: l16 (16 位 PCM) 或 pcma (G.711A 透传)
+    parser.add_argument("--audio-codec", default=os.getenv("AUDIO_CODEC", AUDIO_L16), choices=AUDIO_CODECS)
+    # 音量统计 (dBFS 指标)，设置阈值时同时产生 sound_start/sound_end 事件
+    parser.add_argument("--audio-level", action="store_true", default=os.getenv("AUDIO_LEVEL", "") not in ("", "0"))
+    parser.add_argument("--audio-threshold", type=float, default=float(os.getenv("AUDIO_THRESHOLD")) if os.getenv("AUDIO_THRESHOLD") else None)
+    # 画面活动估计 (按 P 帧大小，不解码)，设置阈值 (相对基线的倍数) 时产生 activity_start/activity_end 事件
+    parser.add_argument("--activity", action="store_true", default=os.getenv("VIDEO_ACTIVITY", "") not in ("", "0"))
+    parser.add_argument("--activity-threshold", type=float,
+                        default=float(os.getenv("ACTIVITY_THRESHOLD")) if os.getenv("ACTIVITY_THRESHOLD") else None)
+    # 事件 webhook，事件以 JSON POST 发送
+    parser.add_argument("--event-webhook", default=os.getenv("EVENT_WEBHOOK", ""))
+    # Prometheus 指标端口，0 表示不启用
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", "0")))
     
     args = parser.parse_args()
+    if args.mode != "run" and not args.file:
+        parser.error(f"{args.mode} requires a capture file")
+    if args.mode == "replay":
+        reader = CaptureReader(args.file)
+        if not reader.complete: logger.warning(f"Capture index missing, rebuilt from {len(reader)} records")
+        bridge = RTSPBridge(args.base_url, args.username, args.password, reader.meta.get("camera_id", "replay"),
+                            args.rtsp_url, reader.meta.get("video_codec") or VIDEO_CODEC_AUTO, reader.meta.get("channel", 0),
+                            reader.meta.get("video_quality", args.video_quality), drop_policy=args.drop_policy,
+                            publisher=args.publisher, audio_codec=args.audio_codec, audio_level=args.audio_level,
+                            audio_threshold=args.audio_threshold, event_sink=EventSink(args.event_webhook),
+                            activity=args.activity, activity_threshold=args.activity_threshold)
+        ok = True
+        try:
+            ok = asyncio.run(run_replay(bridge, reader, args.speed))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            reader.close()
+        if not ok: sys.exit(1)
+        return
     if not args.password: return
 
-    bridge = RTSPBridge(
+    defaults = dict(
         base_url=args.base_url,
         username=args.username,
         password=args.password,
-        camera_id=args.camera_id,
-        rtsp_url=args.rtsp_url,
-        video_codec="hevc",
-        channel=0,
-        video_quality=args.video_quality
+        video_codec=args.video_codec,
+        channel=args.channel,
+        video_quality=args.video_quality,
+        drop_policy=args.drop_policy,
+        publisher=args.publisher,
+        audio_codec=args.audio_codec,
+        audio_level=args.audio_level,
+        audio_threshold=args.audio_threshold,
+        activity=args.activity,
+        activity_threshold=args.activity_threshold,
+        sub_video_quality=args.sub_video_quality,
+        sub_channel=args.sub_channel,
+        on_demand=args.on_demand,
+        idle_timeout=args.idle_timeout,
+        stall_factor=args.stall_factor,
+        stall_min=args.stall_min,
     )
+    if args.config:
+        cameras = load_cameras(args.config, defaults)
+    else:
+        cameras = [dict(defaults, camera_id=args.camera_id, rtsp_url=args.rtsp_url, sub_rtsp_url=args.sub_rtsp_url or None,
+                        on_demand_url=args.on_demand_url or None, sub_on_demand_url=args.sub_on_demand_url or None)]
+    pool = SessionPool()
+    events = EventSink(args.event_webhook)
+    monitor = ConsumerMonitor() if any(params.get("on_demand") for params in cameras) else None
+    bridges = [RTSPBridge(**params, session_pool=pool, event_sink=events, consumer_monitor=monitor) for params in cameras]
+    if args.mode == "capture":
+        # 录制单个摄像头，使用配置文件时为第一个
+        try:
+            asyncio.run(run_capture(bridges[0], args.file, args.duration))
+        except KeyboardInterrupt:
+            pass
+        return
+    logger.info(f"Starting {len(bridges)} camera(s)")
 
     try:
-        asyncio.run(bridge.run_forever())
+        asyncio.run(run_bridges(bridges, args.metrics_port))
     except KeyboardInterrupt:
         pass
 
@@ -0,0 +1,171 @@
+"""在 WS 接收路径上进行的轻量分析，不经过额外的解码进程"""
+import math
+import time
+import collections
+
+from .g711 import alaw_levels
+
+# 16 位 PCM 满幅为 0 dBFS，无声时取下限
+FULL_SCALE = 32768
+DBFS_FLOOR = -96.0
+
+def dbfs(amplitude) -> float:
+    if amplitude <= 0: return DBFS_FLOOR
+    return max(DBFS_FLOOR, 20 * math.log10(amplitude / FULL_SCALE))
+
+class AudioLevel:
+    """按固定窗口统计 A-law 音频的 RMS/峰值 (dBFS)
+
+    threshold 为 RMS 阈值 (dBFS): 窗口音量达到阈值时触发 sound_start 事件，
+    连续 hold 秒低于阈值后触发 sound_end。on_event(event, **fields) 由调用方提供。
+    """
+    def __init__(self, sample_rate=16000, window=0.5, threshold=None, hold=2.0, on_event=None):
+        self.window_samples = max(1, int(sample_rate * window))
+        self.threshold = threshold
+        self.hold = hold
+        self.on_event = on_event
+        # 最近一个完整窗口的音量
+        self.rms = DBFS_FLOOR
+        self.peak = DBFS_FLOOR
+        self.windows = 0
+        self.active = False
+        self.events = 0
+        self._samples = 0
+        self._sum_squares = 0
+        self._peak = 0
+        self._loud_at = 0.0
+        self._event_peak = DBFS_FLOOR
+
+    def feed(self, data):
+        n, squares, peak = alaw_levels(data)
+        self._samples += n
+        self._sum_squares += squares
+        self._peak = max(self._peak, peak)
+        if self._samples >= self.window_samples:
+            self._finish_window()
+
+    def _finish_window(self):
+        self.rms = dbfs(math.sqrt(self._sum_squares / self._samples))
+        self.peak = dbfs(self._peak)
+        self.windows += 1
+        self._samples = self._sum_squares = self._peak = 0
+        if self.threshold is None: return
+
+        now = time.monotonic()
+        if self.rms >= self.threshold:
+            self._loud_at = now
+            self._event_peak = max(self._event_peak, self.peak)
+            if not self.active:
+                self.active = True
+                self.events += 1
+                self._emit("sound_start", rms_dbfs=round(self.rms, 1), peak_dbfs=round(self.peak, 1))
+        elif self.active and now - self._loud_at >= self.hold:
+            self.active = False
+            self._emit("sound_end", peak_dbfs=round(self._event_peak, 1))
+            self._event_peak = DBFS_FLOOR
+
+    def _emit(self, event, **fields):
+        if self.on_event: self.on_event(event, threshold_dbfs=self.threshold, **fields)
+
+class VideoActivity:
+    """根据 P/B 帧大小相对滚动基线的比例估计画面活动，不解码视频
+
+    静止画面的 P 帧只有很少的残差，画面中有运动时 P 帧明显变大。
+    score 为近几帧平均大小与基线 (长期 EWMA) 之比，约为 1 表示与平时相同。
+    关键帧大小取决于画面内容而非运动，不参与统计。
+    达到 threshold 时触发 activity_start 事件，连续 hold 秒低于阈值后触发 activity_end。
+    """
+    def __init__(self, threshold=None, baseline_frames=600, smoothing_frames=10, warmup_frames=50, hold=5.0, on_event=None):
+        self.threshold = threshold
+        self.hold = hold
+        self.on_event = on_event
+        self.warmup_frames = warmup_frames
+        self._baseline_alpha = 1.0 / baseline_frames
+        self._score_alpha = 1.0 / smoothing_frames
+        self.baseline = 0.0 # 字节
+        self.score = 1.0
+        self.frames = 0
+        self.active = False
+        self.events = 0
+        self._active_at = 0.0
+        self._event_score = 0.0
+
+    def feed(self, size, keyframe=False):
+        if keyframe or not size: return
+        self.frames += 1
+        if self.frames <= self.warmup_frames:
+            # 预热阶段用算术平均建立基线，不产生事件
+            self.baseline += (size - self.baseline) / self.frames
+            return
+        self.score += (size / self.baseline - self.score) * self._score_alpha
+        # 活动期间基线更新放慢 10 倍，持续运动不会很快被当作常态；光照、夜视切换等长期变化仍会被吸收
+        alpha = self._baseline_alpha / 10 if self.active else self._baseline_alpha
+        self.baseline += (size - self.baseline) * alpha
+        if self.threshold is None: return
+
+        now = time.monotonic()
+        if self.score >= self.threshold:
+            self._active_at = now
+            self._event_score = max(self._event_score, self.score)
+            if not self.active:
+                self.active = True
+                self.events += 1
+                self._emit("activity_start", score=round(self.score, 2), baseline_bytes=int(self.baseline))
+        elif self.active and now - self._active_at >= self.hold:
+            self.active = False
+            self._emit("activity_end", max_score=round(self._event_score, 2))
+            self._event_score = 0.0
+
+    def _emit(self, event, **fields):
+        if self.on_event: self.on_event(event, threshold=self.threshold, **fields)
+
+class StreamStats:
+    """按帧到达时间统计实测帧率、码率与 GOP 长度
+
+    只保留最近 window 秒的 (到达时间, 字节数)，帧率与码率为窗口内的平均值，
+    网络抖动只影响单帧间隔，不影响窗口平均。
+    """
+    def __init__(self, window=10.0):
+        self.window = window
+        self.frames = collections.deque() # (到达时间, 字节数)
+        self.window_bytes = 0
+        self.gop_frames = 0    # 最近两个关键帧之间的帧数
+        self.gop_seconds = 0.0
+        self._since_key = 0
+        self._key_at = 0.0
+
+    def reset(self):
+        """WS 重连后重新统计，断开期间不计入帧率"""
+        self.frames.clear()
+        self.window_bytes = 0
+        self._since_key = 0
+        self._key_at = 0.0
+
+    def feed(self, size, keyframe=False, now=None):
+        now = time.monotonic() if now is None else now
+        self.frames.append((now, size))
+        self.window_bytes += size
+        while now - self.frames[0][0] > self.window:
+            self.window_bytes -= self.frames.popleft()[1]
+        if keyframe:
+            # 第一个关键帧之前的帧数不完整，不作为 GOP 长度
+            if self._key_at:
+                self.gop_frames = self._since_key
+                self.gop_seconds = now - self._key_at
+            self._key_at = now
+            self._since_key = 0
+        self._since_key += 1
+
+    def _span(self) -> float:
+        return self.frames[-1][0] - self.frames[0][0] if len(self.frames) > 1 else 0.0
+
+    @property
+    def fps(self) -> float:
+        span = self._span()
+        return (len(self.frames) - 1) / span if span else 0.0
+
+    @property
+    def bitrate(self) -> float:
+        """比特/秒，不含第一帧 (它在窗口起点之前传输，窗口内到达的是其后各帧)"""
+        span = self._span()
+        return (self.window_bytes - self.frames[0][1]) * 8 / span if span else 0.0
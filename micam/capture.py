@@ -0,0 +1,132 @@
+"""WS 消息录制与回放文件
+
+文件结构 (小端):
+    头部:   MAGIC(8) | 版本 u16 | 元数据长度 u32 | 元数据 JSON
+    记录:   时间戳 u64 (纳秒，相对录制开始) | 长度 u32 | WS 消息原文 (含类型字节)
+    索引:   每条记录的偏移 u64 ...
+    尾部:   索引偏移 u64 | 记录数 u64 | INDEX_MAGIC(8)
+
+记录只追加写入，正常关闭时写入索引与尾部。录制进程异常退出导致没有尾部时，
+读取时顺序扫描记录重建索引，末尾不完整的记录会被忽略。
+"""
+import sys
+import json
+import mmap
+import time
+import struct
+from array import array
+from typing import Iterator, Tuple
+
+MAGIC = b"MICAMCAP"
+INDEX_MAGIC = b"MICAMIDX"
+VERSION = 1
+
+_HEADER = struct.Struct("<8sHI")
+_RECORD = struct.Struct("<QI")
+_TRAILER = struct.Struct("<QQ8s")
+
+class CaptureWriter:
+    def __init__(self, path, **meta):
+        self.path = path
+        self.file = open(path, "wb")
+        meta = json.dumps({"started_at": time.time(), **meta}).encode()
+        self.file.write(_HEADER.pack(MAGIC, VERSION, len(meta)) + meta)
+        self.offset = _HEADER.size + len(meta)
+        self.index = array("Q")
+        self._start = time.monotonic_ns()
+
+    def write(self, data):
+        """追加一条 WS 消息，时间戳取当前时刻"""
+        if not self.file: return
+        self.index.append(self.offset)
+        self.file.write(_RECORD.pack(time.monotonic_ns() - self._start, len(data)))
+        self.file.write(data)
+        self.offset += _RECORD.size + len(data)
+
+    def close(self):
+        if not self.file: return
+        if self.index.itemsize != 8: raise RuntimeError("array('Q') is not 64-bit")
+        # 索引按小端写入，大端主机上先转换字节序
+        if sys.byteorder == "big": self.index.byteswap()
+        self.file.write(self.index.tobytes())
+        self.file.write(_TRAILER.pack(self.offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CaptureReader:
+    """通过 mmap 读取录制文件，按索引随机访问，返回的消息为 memoryview 不复制数据"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self.mm)
+        magic, version, meta_len = _HEADER.unpack_from(self.buf)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Not a micam capture: {path}")
+        self.data_start = _HEADER.size + meta_len
+        self.meta = json.loads(bytes(self.buf[_HEADER.size:self.data_start]))
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = self._scan_index()
+            self.complete = False
+        else:
+            self.complete = True
+
+    def _read_index(self):
+        if len(self.buf) < self.data_start + _TRAILER.size: return None
+        index_offset, count, magic = _TRAILER.unpack_from(self.buf, len(self.buf) - _TRAILER.size)
+        if magic != INDEX_MAGIC or index_offset + count * 8 + _TRAILER.size != len(self.buf): return None
+        index = self.buf[index_offset:index_offset + count * 8]
+        if sys.byteorder == "little": return index.cast("Q")
+        # 大端主机上不能直接引用 mmap，复制后转换字节序
+        swapped = array("Q")
+        swapped.frombytes(index)
+        swapped.byteswap()
+        return swapped
+
+    def _scan_index(self):
+        index = array("Q")
+        pos, end = self.data_start, len(self.buf)
+        while pos + _RECORD.size <= end:
+            _, size = _RECORD.unpack_from(self.buf, pos)
+            if pos + _RECORD.size + size > end: break
+            index.append(pos)
+            pos += _RECORD.size + size
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i) -> Tuple[float, memoryview]:
+        """返回第 i 条记录的 (相对时间秒, 消息)"""
+        pos = self.index[i]
+        ts, size = _RECORD.unpack_from(self.buf, pos)
+        pos += _RECORD.size
+        return ts / 1e9, self.buf[pos:pos + size]
+
+    def __iter__(self) -> Iterator[Tuple[float, memoryview]]:
+        for i in range(len(self.index)):
+            yield self[i]
+
+    @property
+    def duration(self) -> float:
+        return self[len(self) - 1][0] if len(self) else 0.0
+
+    def close(self):
+        # 释放所有 memoryview 后才能关闭 mmap，调用方不应继续持有返回的消息
+        if isinstance(self.__dict__.get("index"), memoryview): self.index.release()
+        self.buf.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
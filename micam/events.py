@@ -0,0 +1,48 @@
+import time
+import asyncio
+import logging
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger("Bridge")
+
+class EventSink:
+    """摄像头事件 (声音、画面活动等) 的输出
+
+    每个事件写一条日志；配置了 webhook 时另以 JSON POST 发送，发送在后台任务中进行，不阻塞 WS 接收。
+    所有摄像头共享一个实例与 HTTP 会话。
+    """
+    def __init__(self, webhook=None, timeout=5.0):
+        self.webhook = webhook or None
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._tasks = set()
+
+    def emit(self, camera, event, **fields):
+        logger.info(f"[{camera}] Event {event}: " + ", ".join(f"{k}={v}" for k, v in fields.items()))
+        if not self.webhook: return
+        payload = {"camera": camera, "event": event, "time": time.time(), **fields}
+        task = asyncio.ensure_future(self._post(payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _post(self, payload):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            async with self.session.post(self.webhook, json=payload) as resp:
+                resp.raise_for_status()
+            self.sent += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"[{payload['camera']}] Event webhook failed: {e}")
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.session:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,470 @@
+"""本地 Miloco 替身，用于基准测试与重连测试
+
+实现 /api/auth/login、/api/miot/login_status 与 /api/miot/ws/video_stream，
+按配置的帧率/码率推送合成的 (或录制的) HEVC/H.264 码流与 G.711A 音频，
+并可周期性地断开 WS、停止发送或使登录失效。
+
+    python -m micam.fake_miloco --port 8000 --codec hevc --fps 20 --drop-every 30
+"""
+import os
+import math
+import random
+import asyncio
+import argparse
+import logging
+import secrets
+from typing import Dict, List
+
+from aiohttp import web
+
+from . import nal
+from .g711 import alaw_encode
+from .capture import CaptureReader
+
+logger = logging.getLogger("FakeMiloco")
+
+AUDIO_SAMPLE_RATE = 16000
+
+class BitWriter:
+    """按位写入 RBSP，支持 Exp-Golomb 编码"""
+    def __init__(self):
+        self.bits: List[int] = []
+
+    def u(self, n, value):
+        for i in range(n - 1, -1, -1):
+            self.bits.append((value >> i) & 1)
+
+    def ue(self, value):
+        value += 1
+        n = value.bit_length()
+        self.u(n - 1, 0)
+        self.u(n, value)
+
+    def se(self, value):
+        self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def rbsp(self) -> bytes:
+        """补齐 rbsp_trailing_bits 后返回字节"""
+        bits = self.bits + [1]
+        bits += [0] * (-len(bits) % 8)
+        return bytes(int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+def escape_rbsp(rbsp) -> bytes:
+    """插入防竞争字节 (emulation prevention)，避免负载中出现起始码"""
+    out = bytearray()
+    zeros = 0
+    for b in rbsp:
+        if zeros >= 2 and b <= 3:
+            out.append(3)
+            zeros = 0
+        out.append(b)
+        zeros = zeros + 1 if b == 0 else 0
+    return bytes(out)
+
+def _hevc_profile_tier_level(w, level_idc):
+    w.u(2, 0)            # general_profile_space
+    w.u(1, 0)            # general_tier_flag
+    w.u(5, 1)            # general_profile_idc: Main
+    w.u(32, 0x60000000)  # general_profile_compatibility_flag[1..2]
+    w.u(4, 0b1001)       # progressive / interlaced / non_packed / frame_only
+    w.u(44, 0)           # reserved
+    w.u(8, level_idc)
+
+def hevc_parameter_sets(width, height, fps, level_idc=120):
+    """生成合法的 HEVC Main VPS/SPS/PPS (不含起始码)"""
+    vps = BitWriter()
+    vps.u(4, 0); vps.u(1, 1); vps.u(1, 1); vps.u(6, 0); vps.u(3, 0); vps.u(1, 1)
+    vps.u(16, 0xFFFF)
+    _hevc_profile_tier_level(vps, level_idc)
+    vps.u(1, 1); vps.ue(1); vps.ue(0); vps.ue(0) # sub_layer_ordering_info
+    vps.u(6, 0); vps.ue(0)                       # vps_max_layer_id / num_layer_sets_minus1
+    vps.u(1, 1); vps.u(32, 1); vps.u(32, fps); vps.u(1, 0); vps.ue(0) # timing_info
+    vps.u(1, 0)                                  # vps_extension_flag
+
+    sps = BitWriter()
+    sps.u(4, 0); sps.u(3, 0); sps.u(1, 1)
+    _hevc_profile_tier_level(sps, level_idc)
+    sps.ue(0); sps.ue(1)                         # sps_id / chroma_format_idc 4:2:0
+    sps.ue(width); sps.ue(height)
+    sps.u(1, 0)                                  # conformance_window_flag
+    sps.ue(0); sps.ue(0)                         # bit_depth 8
+    sps.ue(4)                                    # log2_max_pic_order_cnt_lsb_minus4
+    sps.u(1, 1); sps.ue(1); sps.ue(0); sps.ue(0) # sub_layer_ordering_info
+    sps.ue(0); sps.ue(3); sps.ue(0); sps.ue(3); sps.ue(0); sps.ue(0) # CB/TB 尺寸与层级
+    sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0) # scaling_list / amp / sao / pcm
+    sps.ue(0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0) # st_rps / long_term / tmvp / strong_intra
+    sps.u(1, 1)                                  # vui_parameters_present_flag
+    sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0)
+    sps.u(1, 1); sps.u(32, 1); sps.u(32, fps); sps.u(1, 0); sps.u(1, 0) # vui timing_info
+    sps.u(1, 0)                                  # bitstream_restriction_flag
+    sps.u(1, 0)                                  # sps_extension_present_flag
+
+    pps = BitWriter()
+    pps.ue(0); pps.ue(0)
+    pps.u(1, 0); pps.u(1, 0); pps.u(3, 0); pps.u(1, 0); pps.u(1, 0)
+    pps.ue(0); pps.ue(0); pps.se(0)
+    pps.u(1, 0); pps.u(1, 0); pps.u(1, 0)
+    pps.se(0); pps.se(0)
+    pps.u(1, 0); pps.u(1, 0); pps.u(1, 0); pps.u(1, 0); pps.u(1, 0); pps.u(1, 0)
+    pps.u(1, 0); pps.u(1, 0); pps.u(1, 0); pps.u(1, 0)
+    pps.ue(0); pps.u(1, 0); pps.u(1, 0)
+
+    return [b"\x40\x01" + escape_rbsp(vps.rbsp()),
+            b"\x42\x01" + escape_rbsp(sps.rbsp()),
+            b"\x44\x01" + escape_rbsp(pps.rbsp())]
+
+def hevc_slice_header(keyframe, poc):
+    w = BitWriter()
+    w.u(1, 1)                    # first_slice_segment_in_pic_flag
+    if keyframe: w.u(1, 0)       # no_output_of_prior_pics_flag
+    w.ue(0)                      # slice_pic_parameter_set_id
+    w.ue(2 if keyframe else 1)   # slice_type: I / P
+    if not keyframe:
+        w.u(8, poc & 0xff)       # slice_pic_order_cnt_lsb
+        w.u(1, 0); w.ue(1); w.ue(0); w.ue(0); w.u(1, 1) # st_ref_pic_set: 1 个前向参考
+        w.u(1, 0); w.ue(0)       # num_ref_idx_active_override_flag / five_minus_max_num_merge_cand
+    w.se(0)                      # slice_qp_delta
+    nal_header = b"\x26\x01" if keyframe else b"\x02\x01" # IDR_W_RADL / TRAIL_R
+    return nal_header + w.rbsp()
+
+def h264_parameter_sets(width, height, fps, level_idc=40):
+    """生成合法的 H.264 Baseline SPS/PPS (不含起始码)"""
+    mbs_w, mbs_h = (width + 15) // 16, (height + 15) // 16
+    sps = BitWriter()
+    sps.u(8, 66); sps.u(8, 0xC0); sps.u(8, level_idc)
+    sps.ue(0)                    # seq_parameter_set_id
+    sps.ue(4)                    # log2_max_frame_num_minus4
+    sps.ue(2)                    # pic_order_cnt_type
+    sps.ue(1); sps.u(1, 0)       # max_num_ref_frames / gaps_in_frame_num_allowed
+    sps.ue(mbs_w - 1); sps.ue(mbs_h - 1)
+    sps.u(1, 1); sps.u(1, 1)     # frame_mbs_only / direct_8x8_inference
+    crop_right, crop_bottom = (mbs_w * 16 - width) // 2, (mbs_h * 16 - height) // 2
+    if crop_right or crop_bottom:
+        sps.u(1, 1); sps.ue(0); sps.ue(crop_right); sps.ue(0); sps.ue(crop_bottom)
+    else:
+        sps.u(1, 0)
+    sps.u(1, 1)                  # vui_parameters_present_flag
+    sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0)
+    sps.u(1, 1); sps.u(32, 1); sps.u(32, fps * 2); sps.u(1, 1) # timing_info
+    sps.u(1, 0); sps.u(1, 0); sps.u(1, 0); sps.u(1, 0)
+
+    pps = BitWriter()
+    pps.ue(0); pps.ue(0); pps.u(1, 0); pps.u(1, 0); pps.ue(0)
+    pps.ue(0); pps.ue(0); pps.u(1, 0); pps.u(2, 0)
+    pps.se(0); pps.se(0); pps.se(0)
+    pps.u(1, 1); pps.u(1, 0); pps.u(1, 0)
+
+    return [b"\x67" + escape_rbsp(sps.rbsp()), b"\x68" + escape_rbsp(pps.rbsp())]
+
+def h264_slice_header(keyframe, frame_num):
+    w = BitWriter()
+    w.ue(0)                      # first_mb_in_slice
+    w.ue(7 if keyframe else 5)   # slice_type: I / P
+    w.ue(0)                      # pic_parameter_set_id
+    w.u(8, frame_num & 0xff)     # frame_num
+    if keyframe:
+        w.ue(0)                  # idr_pic_id
+    else:
+        w.u(1, 0); w.u(1, 0)     # num_ref_idx_active_override / ref_pic_list_modification
+    if keyframe:
+        w.u(1, 0); w.u(1, 0)     # no_output_of_prior_pics / long_term_reference
+    else:
+        w.u(1, 0)                # adaptive_ref_pic_marking_mode_flag
+    w.se(0); w.ue(1)             # slice_qp_delta / disable_deblocking_filter_idc
+    return (b"\x65" if keyframe else b"\x41") + w.rbsp()
+
+class VideoSource:
+    """逐帧产生 Annex-B 访问单元 (AU)，合成或读取录制文件"""
+    def __init__(self, codec, fps, gop, bitrate_kbps, width, height, video_file=None, motion_every=0.0, motion_for=0.0):
+        self.codec = codec
+        self.fps = fps
+        self.gop = gop
+        # 每 motion_every 秒的最后 motion_for 秒模拟画面运动，P 帧变为 4 倍大小
+        self.motion_period = int(motion_every * fps)
+        self.motion_frames = int(motion_for * fps)
+        self.aus: List[bytes] = []
+        if video_file:
+            with open(video_file, "rb") as f:
+                self.aus = split_access_units(f.read(), codec)
+            return
+        # 关键帧约为 P 帧的 8 倍
+        gop_bytes = bitrate_kbps * 1000 // 8 * gop // fps
+        self.inter_size = max(gop_bytes // (gop + 7), 64)
+        self.key_size = self.inter_size * 8
+        if codec == nal.HEVC:
+            self.param_sets = nal.annexb(hevc_parameter_sets(width, height, fps))
+        else:
+            self.param_sets = nal.annexb(h264_parameter_sets(width, height, fps))
+        self.noise = escape_rbsp(os.urandom(self.key_size * 5 // 4 + 1024))
+
+    def frame(self, index) -> bytes:
+        if self.aus:
+            return self.aus[index % len(self.aus)]
+        pos = index % self.gop
+        keyframe = pos == 0
+        size = self.key_size if keyframe else self.inter_size
+        if not keyframe and self.motion_period and index % self.motion_period >= self.motion_period - self.motion_frames:
+            size *= 4
+        # 帧大小带 ±25% 抖动，模拟真实码流
+        size = int(size * random.uniform(0.75, 1.25))
+        if self.codec == nal.HEVC:
+            header = hevc_slice_header(keyframe, pos)
+        else:
+            header = h264_slice_header(keyframe, pos)
+        start = random.randrange(0, len(self.noise) - size)
+        slice_nal = b"\x00\x00\x00\x01" + header + self.noise[start:start + size]
+        return self.param_sets + slice_nal if keyframe else slice_nal
+
+def split_access_units(data, codec) -> List[bytes]:
+    """把 Annex-B 码流切分为访问单元: 非 VCL NAL 与其后的 VCL NAL 合为一帧 (每帧单 slice)"""
+    aus, start = [], None
+    for nal_start, nal_end in nal.iter_nal_units(data):
+        head = nal_start - 4 if nal_start >= 4 and data[nal_start - 4] == 0 else nal_start - 3
+        if start is None: start = head
+        if nal_start < nal_end and nal.is_vcl(codec, nal.nal_type(codec, data[nal_start])):
+            aus.append(data[start:nal_end])
+            start = None
+    return aus
+
+class AudioSource:
+    """G.711A 音频: 440Hz 正弦 (合成) 或录制的 alaw 文件"""
+    def __init__(self, audio_file=None):
+        if audio_file:
+            with open(audio_file, "rb") as f:
+                self.data = f.read()
+        else:
+            # 440Hz 在 16k 采样下 400 个样本恰好 11 个周期，可无缝循环
+            self.data = bytes(alaw_encode(int(8000 * math.sin(2 * math.pi * 440 * i / AUDIO_SAMPLE_RATE)))
+                              for i in range(400)) * 40
+        self.pos = 0
+
+    def read(self, size) -> bytes:
+        out = bytearray()
+        while len(out) < size:
+            chunk = self.data[self.pos:self.pos + size - len(out)]
+            out += chunk
+            self.pos = (self.pos + len(chunk)) % len(self.data)
+        return bytes(out)
+
+class CameraState:
+    def __init__(self):
+        self.frame_index = 0 # 重连后从上次断开处继续，与真实摄像头一样可能从 GOP 中间开始
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+
+class FakeMiloco:
+    def __init__(self, codec=nal.HEVC, fps=20, gop=40, bitrate=2000, width=1920, height=1080,
+                 audio_chunk_ms=64, video_file=None, audio_file=None, capture=None, password="", cameras=0,
+                 drop_every=0.0, stall_every=0.0, stall_for=0.0, expire_every=0.0, motion_every=0.0, motion_for=0.0):
+        self.codec = codec
+        self.fps = fps
+        self.gop = gop
+        self.bitrate = bitrate
+        self.width = width
+        self.height = height
+        self.audio_chunk_ms = audio_chunk_ms
+        self.video_file = video_file
+        self.audio_file = audio_file
+        # 指定录制文件时忽略合成参数，所有摄像头回放同一份录制
+        self.capture = CaptureReader(capture) if capture else None
+        self.password = password
+        # cameras > 0 时只接受 cam1..camN，否则接受任意 camera_id
+        self.camera_ids = {f"cam{i + 1}" for i in range(cameras)}
+        self.drop_every = drop_every
+        self.stall_every = stall_every
+        self.stall_for = stall_for
+        self.expire_every = expire_every
+        self.motion_every = motion_every
+        self.motion_for = motion_for
+        self.tokens = set()
+        self.logins = 0
+        self.cameras: Dict[str, CameraState] = {}
+        self.sources: Dict[str, VideoSource] = {}
+        self.websockets = set()
+        self._tasks = []
+
+    def _authorized(self, request) -> bool:
+        return request.cookies.get("session") in self.tokens
+
+    async def login(self, request):
+        try:
+            body = await request.json()
+        except Exception:
+            body = {}
+        if self.password and body.get("password") != self.password:
+            return web.json_response({"code": -1, "message": "invalid password"}, status=401)
+        token = secrets.token_hex(16)
+        self.tokens.add(token)
+        self.logins += 1
+        resp = web.json_response({"code": 0, "message": "ok"})
+        resp.set_cookie("session", token)
+        return resp
+
+    async def login_status(self, request):
+        if not self._authorized(request):
+            return web.json_response({"code": -1}, status=401)
+        return web.json_response({"code": 0, "data": {"is_logged_in": True}})
+
+    def _video_source(self, quality) -> VideoSource:
+        """video_quality 为 1 时提供低码率子码流"""
+        if quality not in self.sources:
+            if quality == "1" and not self.video_file:
+                self.sources[quality] = VideoSource(self.codec, self.fps, self.gop, self.bitrate // 4, 640, 360,
+                                                    motion_every=self.motion_every, motion_for=self.motion_for)
+            else:
+                self.sources[quality] = VideoSource(self.codec, self.fps, self.gop, self.bitrate, self.width, self.height,
+                                                    self.video_file, self.motion_every, self.motion_for)
+        return self.sources[quality]
+
+    async def video_stream(self, request):
+        if not self._authorized(request):
+            return web.json_response({"code": -1}, status=401)
+        camera_id = request.query.get("camera_id", "")
+        if self.camera_ids and camera_id not in self.camera_ids:
+            return web.json_response({"code": -1, "message": "camera not found"}, status=404)
+        channel = request.query.get("channel", "0")
+        quality = request.query.get("video_quality", "2")
+        key = f"{camera_id}/{channel}/{quality}"
+        state = self.cameras.setdefault(key, CameraState())
+        state.connections += 1
+
+        ws = web.WebSocketResponse(heartbeat=15.0)
+        await ws.prepare(request)
+        self.websockets.add(ws)
+        try:
+            if self.capture:
+                messages = self._replay_capture()
+            else:
+                messages = self._synthetic(state, self._video_source(quality), AudioSource(self.audio_file))
+            await self._stream(ws, state, messages)
+        except (ConnectionError, RuntimeError):
+            pass
+        finally:
+            self.websockets.discard(ws)
+            if not ws.closed: await ws.close()
+        return ws
+
+    def _synthetic(self, state, video, audio):
+        """按帧率与音频块时长交错产生 (相对时间, WS 消息)"""
+        chunk = AUDIO_SAMPLE_RATE * self.audio_chunk_ms // 1000
+        video_t = audio_t = 0.0
+        while True:
+            if video_t <= audio_t:
+                yield video_t, b"\x01" + video.frame(state.frame_index)
+                state.frame_index += 1
+                video_t += 1 / video.fps
+            else:
+                yield audio_t, b"\x02" + audio.read(chunk)
+                audio_t += chunk / AUDIO_SAMPLE_RATE
+
+    def _replay_capture(self):
+        """按录制时的时间戳循环回放 micam capture 文件"""
+        offset = 0.0
+        while True:
+            for ts, data in self.capture:
+                yield offset + ts, bytes(data)
+            offset += self.capture.duration + 0.05
+
+    async def _stream(self, ws, state, messages):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.drop_every * random.uniform(0.5, 1.5) if self.drop_every else None
+        next_stall = start + self.stall_every if self.stall_every else None
+        for t, data in messages:
+            if ws.closed: return
+            now = loop.time()
+            if deadline and now >= deadline:
+                logger.info("Dropping WebSocket (fault injection)")
+                return
+            if next_stall and now >= next_stall:
+                logger.info(f"Stalling stream for {self.stall_for}s (fault injection)")
+                await asyncio.sleep(self.stall_for)
+                # 停顿期间的数据不补发，时间轴整体后移
+                start += self.stall_for
+                next_stall += self.stall_every + self.stall_for
+            await asyncio.sleep(max(0.0, start + t - loop.time()))
+            await ws.send_bytes(data)
+            state.messages += 1
+            state.bytes += len(data)
+
+    async def stats(self, request):
+        return web.json_response({
+            "logins": self.logins,
+            "streams": {k: {"connections": s.connections, "messages": s.messages, "bytes": s.bytes}
+                        for k, s in self.cameras.items()},
+        })
+
+    async def _expire_sessions(self):
+        """模拟 Miloco 重启: 旧 Cookie 失效并断开所有 WS"""
+        while True:
+            await asyncio.sleep(self.expire_every)
+            logger.info("Expiring all sessions (fault injection)")
+            self.tokens.clear()
+            for ws in list(self.websockets):
+                await ws.close()
+
+    async def _on_startup(self, app):
+        if self.expire_every:
+            self._tasks.append(asyncio.ensure_future(self._expire_sessions()))
+
+    async def _on_cleanup(self, app):
+        for task in self._tasks: task.cancel()
+        for ws in list(self.websockets):
+            await ws.close()
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/auth/login", self.login)
+        app.router.add_get("/api/miot/login_status", self.login_status)
+        app.router.add_get("/api/miot/ws/video_stream", self.video_stream)
+        app.router.add_get("/stats", self.stats)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def start(self, host="127.0.0.1", port=8000) -> web.AppRunner:
+        """在当前事件循环中启动，供基准测试在同一进程内使用"""
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Miloco stand-in for micam benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--codec", default=nal.HEVC, choices=(nal.HEVC, nal.H264))
+    parser.add_argument("--fps", type=int, default=20)
+    parser.add_argument("--gop", type=int, default=40, help="keyframe interval in frames")
+    parser.add_argument("--bitrate", type=int, default=2000, help="main stream bitrate in kbps")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--audio-chunk-ms", type=int, default=64)
+    parser.add_argument("--video-file", help="raw Annex-B file to replay instead of synthetic video")
+    parser.add_argument("--audio-file", help="raw G.711 A-law 16 kHz file to replay")
+    parser.add_argument("--capture", help="micam capture file to replay with its original timing")
+    parser.add_argument("--password", default="", help="required login password (any if empty)")
+    parser.add_argument("--cameras", type=int, default=0, help="only accept camera ids cam1..camN")
+    parser.add_argument("--drop-every", type=float, default=0.0, help="close each WS after ~N seconds")
+    parser.add_argument("--stall-every", type=float, default=0.0, help="stop sending every N seconds")
+    parser.add_argument("--stall-for", type=float, default=5.0, help="stall duration in seconds")
+    parser.add_argument("--expire-every", type=float, default=0.0, help="invalidate all sessions every N seconds")
+    parser.add_argument("--motion-every", type=float, default=0.0, help="simulate motion (4x P-frame size) every N seconds")
+    parser.add_argument("--motion-for", type=float, default=3.0, help="motion duration in seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fake = FakeMiloco(
+        codec=args.codec, fps=args.fps, gop=args.gop, bitrate=args.bitrate,
+        width=args.width, height=args.height, audio_chunk_ms=args.audio_chunk_ms,
+        video_file=args.video_file, audio_file=args.audio_file, capture=args.capture, password=args.password,
+        cameras=args.cameras, drop_every=args.drop_every, stall_every=args.stall_every,
+        stall_for=args.stall_for if args.stall_every else 0.0, expire_every=args.expire_every,
+        motion_every=args.motion_every, motion_for=args.motion_for,
+    )
+    logger.info(f"Fake Miloco listening on http://{args.host}:{args.port}")
+    web.run_app(fake.make_app(), host=args.host, port=args.port, print=None, access_log=None)
+
+if __name__ == "__main__":
+    main()
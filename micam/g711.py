@@ -0,0 +1,82 @@
+"""G.711 A-law 编解码 (小米摄像头音频为 16k 单声道 A-law)"""
+import sys
+import array
+from typing import Tuple
+
+def alaw_encode(sample) -> int:
+    """16 位线性 PCM 编码为 G.711 A-law"""
+    sign = 0x80 if sample >= 0 else 0
+    if not sign: sample = -sample - 1
+    sample = min(sample, 32767) >> 3
+    if sample < 32:
+        value = sample >> 1
+    else:
+        exp = sample.bit_length() - 5
+        value = (exp << 4) | ((sample >> exp) & 0x0f)
+    return (value | sign) ^ 0x55
+
+def alaw_decode(value) -> int:
+    """G.711 A-law 解码为 16 位线性 PCM"""
+    value ^= 0x55
+    t = (value & 0x0f) << 4
+    seg = (value & 0x70) >> 4
+    if seg == 0:
+        t += 8
+    else:
+        t = (t + 0x108) << (seg - 1)
+    return t if value & 0x80 else -t
+
+ALAW_TO_LINEAR = tuple(alaw_decode(v) for v in range(256))
+
+# 高/低字节分别查表，bytes.translate 在 C 层完成逐字节映射
+_L16_HIGH = bytes((v >> 8) & 0xff for v in ALAW_TO_LINEAR)
+_L16_LOW = bytes(v & 0xff for v in ALAW_TO_LINEAR)
+
+def alaw_to_l16(data) -> bytes:
+    """A-law 解码为 16 位大端 PCM (RTP L16)"""
+    data = bytes(data)
+    out = bytearray(len(data) * 2)
+    out[0::2] = data.translate(_L16_HIGH)
+    out[1::2] = data.translate(_L16_LOW)
+    return bytes(out)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 原生字节序的 16 位 PCM，可直接由 array/numpy 解释
+_PCM_FIRST, _PCM_SECOND = (_L16_LOW, _L16_HIGH) if sys.byteorder == "little" else (_L16_HIGH, _L16_LOW)
+_NP_LINEAR = numpy.array(ALAW_TO_LINEAR, dtype=numpy.int16) if numpy is not None else None
+
+def alaw_to_pcm(data):
+    """A-law 解码为 16 位线性样本: 安装了 numpy 时为 int16 ndarray，否则为 array('h')"""
+    if numpy is not None:
+        return _NP_LINEAR[numpy.frombuffer(data, dtype=numpy.uint8)]
+    data = bytes(data)
+    out = bytearray(len(data) * 2)
+    out[0::2] = data.translate(_PCM_FIRST)
+    out[1::2] = data.translate(_PCM_SECOND)
+    return array.array('h', out)
+
+# 无 numpy 时: 每个码值的平方 (< 2^30) 按原生字节序拆成 4 个字节表，translate 后由 array 按 uint32 解释求和；
+# 码值去掉符号位后的低 7 位随幅度单调递增，峰值从大到小查找出现的码值即可
+_U32 = 'I' if array.array('I').itemsize == 4 else 'L'
+_SQUARE_TABLES = [bytes(((v * v) >> (8 * i)) & 0xff for v in ALAW_TO_LINEAR) for i in range(4)]
+if sys.byteorder == "big": _SQUARE_TABLES.reverse()
+_MAGNITUDE = bytes((v ^ 0x55) & 0x7f for v in range(256))
+_MAGNITUDE_PEAK = tuple(abs(alaw_decode(m ^ 0x55)) for m in range(128))
+
+def alaw_levels(data) -> Tuple[int, int, int]:
+    """返回 (样本数, 平方和, 峰值绝对值)，可跨多条消息累加为一个统计窗口"""
+    if not len(data): return 0, 0, 0
+    if numpy is not None:
+        pcm = alaw_to_pcm(data).astype(numpy.int64)
+        return len(pcm), int(numpy.dot(pcm, pcm)), int(numpy.abs(pcm).max())
+    data = bytes(data)
+    squares = bytearray(len(data) * 4)
+    for i, table in enumerate(_SQUARE_TABLES):
+        squares[i::4] = data.translate(table)
+    magnitude = data.translate(_MAGNITUDE)
+    peak = next(m for m in range(127, -1, -1) if bytes((m,)) in magnitude)
+    return len(data), sum(array.array(_U32, squares)), _MAGNITUDE_PEAK[peak]
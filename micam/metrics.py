@@ -0,0 +1,117 @@
+import asyncio
+import bisect
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("Bridge")
+
+# 默认桶 (秒)，覆盖从毫秒级到重连超时的范围
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Prometheus 风格的直方图，只在单个事件循环中使用，无需加锁"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """返回 [(上界, 累计次数)]，上界 None 表示 +Inf"""
+        result, total = [], 0
+        for le, n in zip(self.buckets + (None,), self.counts):
+            total += n
+            result.append((le, total))
+        return result
+
+def _format_labels(labels) -> str:
+    if not labels: return ""
+    def escape(v):
+        return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+def _format_value(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def render(samples) -> str:
+    """把 (名称, 类型, 说明, 标签, 值) 样本渲染为 Prometheus 文本格式，同名样本合并输出"""
+    families = {}
+    for name, kind, doc, labels, value in samples:
+        families.setdefault(name, (kind, doc, []))[2].append((labels, value))
+    lines = []
+    for name, (kind, doc, values) in families.items():
+        lines.append(f"# HELP {name} {doc}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in values:
+            if kind != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            for le, count in value.cumulative():
+                bucket = {**labels, "le": "+Inf" if le is None else repr(le)}
+                lines.append(f"{name}_bucket{_format_labels(bucket)} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value.sum)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+    return "\n".join(lines) + "\n"
+
+class LoopLag:
+    """周期性休眠，测量事件循环被阻塞的延迟"""
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - t - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+
+class MetricsServer:
+    """与摄像头共用事件循环的 HTTP 服务，/metrics 输出 Prometheus 指标，/status 输出各摄像头状态 (JSON)
+
+    bridges 为各摄像头的主码流，子码流 (bridge.streams) 的指标与状态一并输出。
+    """
+    def __init__(self, bridges, host="0.0.0.0", port=9100):
+        self.bridges = bridges
+        self.host = host
+        self.port = port
+        self.loop_lag = LoopLag()
+        self.runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def samples(self):
+        yield "micam_cameras", "gauge", "Number of configured cameras", {}, len(self.bridges)
+        yield "micam_event_loop_lag_seconds", "gauge", "Last measured event loop scheduling delay", {}, self.loop_lag.lag
+        yield "micam_event_loop_lag_max_seconds", "gauge", "Maximum event loop scheduling delay since start", {}, self.loop_lag.max_lag
+        for bridge in self.bridges:
+            for stream in bridge.streams: yield from stream.metrics()
+
+    async def handle_metrics(self, request):
+        return web.Response(body=render(self.samples()).encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def handle_status(self, request):
+        return web.json_response({"cameras": [stream.status() for bridge in self.bridges for stream in bridge.streams]})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/status", self.handle_status)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self._lag_task = asyncio.ensure_future(self.loop_lag.run())
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._lag_task: self._lag_task.cancel()
+        if self.runner: await self.runner.cleanup()
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger("Bridge")
+
+class MilocoSession:
+    """同一个 Miloco 的所有摄像头共享一个 HTTP 会话、连接池与登录 Cookie"""
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.logged_in = False
+        # 每次重新登录 +1，用于合并多个摄像头同时发起的重新认证
+        self.generation = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _ensure_session(self):
+        if self.session is None or self.session.closed:
+            jar = aiohttp.CookieJar(unsafe=True)
+            timeout = aiohttp.ClientTimeout(total=None, connect=10, sock_read=20)
+            # 每个 WebSocket 长期占用一个连接，不能限制连接数
+            connector = aiohttp.TCPConnector(limit=0, ssl=False)
+            self.session = aiohttp.ClientSession(cookie_jar=jar, timeout=timeout, connector=connector)
+            self.logged_in = False
+        return self.session
+
+    async def _login(self) -> bool:
+        session = self._ensure_session()
+        try:
+            await session.post(f"{self.base_url}/api/auth/login",
+                             json={"username": self.username, "password": self.password}, ssl=False)
+            return await self.check()
+        except Exception as e:
+            logger.error(f"[{self.base_url}] Login error: {e}")
+            return False
+
+    async def check(self) -> bool:
+        """通过 login_status 确认当前 Cookie 仍然有效"""
+        session = self._ensure_session()
+        try:
+            async with session.get(f"{self.base_url}/api/miot/login_status", ssl=False) as r:
+                return r.status == 200
+        except Exception as e:
+            logger.error(f"[{self.base_url}] Login status error: {e}")
+            return False
+
+    async def login(self, stale_generation=None) -> bool:
+        """登录一次供所有摄像头使用
+
+        stale_generation 为调用方发现认证失效时看到的 generation，
+        如果期间已有其他摄像头完成了重新登录，则直接复用。
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.logged_in and stale_generation != self.generation:
+                return True
+            self.logged_in = await self._login()
+            if self.logged_in:
+                self.generation += 1
+                logger.info(f"[{self.base_url}] Logged in")
+            return self.logged_in
+
+    async def ws_connect(self, url, **kwargs) -> aiohttp.ClientWebSocketResponse:
+        """建立 WebSocket，认证失效 (401) 时重新登录并重试一次"""
+        if not await self.login():
+            raise ConnectionError("Login failed")
+        generation = self.generation
+        try:
+            return await self.session.ws_connect(url, ssl=False, **kwargs)
+        except aiohttp.WSServerHandshakeError as e:
+            if e.status != 401 and await self.check():
+                raise
+            logger.info(f"[{self.base_url}] Session expired ({e.status}), re-authenticating")
+        if not await self.login(stale_generation=generation):
+            raise ConnectionError("Login failed")
+        return await self.session.ws_connect(url, ssl=False, **kwargs)
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        self.logged_in = False
+
+class SessionPool:
+    """按 Miloco 地址与账号复用 MilocoSession"""
+    def __init__(self):
+        self.sessions: Dict[Tuple[str, str, str], MilocoSession] = {}
+
+    def get(self, base_url, username, password) -> MilocoSession:
+        key = (base_url.rstrip('/'), username, password)
+        if key not in self.sessions:
+            self.sessions[key] = MilocoSession(*key)
+        return self.sessions[key]
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
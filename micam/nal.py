@@ -0,0 +1,327 @@
+"""Annex-B 码流的轻量 NAL 单元扫描
+
+只读取 NAL 头，用于判断一帧是否为关键帧 (IRAP/IDR)、是否携带参数集。
+扫描到第一个 VCL (图像数据) NAL 即停止，不会遍历数百 KB 的关键帧数据。
+"""
+import re
+from typing import NamedTuple
+
+HEVC = "hevc"
+H264 = "h264"
+
+START_CODE = b"\x00\x00\x01"
+# 正则可直接在 memoryview 上查找，避免为切片复制数据
+_START_CODE_RE = re.compile(re.escape(START_CODE))
+
+# HEVC NAL 类型
+HEVC_IRAP = range(16, 24) # BLA/IDR/CRA 及保留的 IRAP
+HEVC_VPS = 32
+HEVC_SPS = 33
+HEVC_PPS = 34
+HEVC_PARAM_SETS = (HEVC_VPS, HEVC_SPS, HEVC_PPS)
+
+# H.264 NAL 类型
+H264_SLICE = 1
+H264_IDR = 5
+H264_SPS = 7
+H264_PPS = 8
+H264_PARAM_SETS = (H264_SPS, H264_PPS)
+
+class FrameInfo(NamedTuple):
+    keyframe: bool   # 第一个 VCL NAL 为 IRAP/IDR
+    param_sets: bool # 帧内携带 VPS/SPS/PPS
+    vcl: bool        # 帧内包含图像数据
+
+    @property
+    def random_access(self) -> bool:
+        """可以作为解码起点: 关键帧或参数集"""
+        return self.keyframe or self.param_sets
+
+def iter_nal_units(buf, start=0, end=None):
+    """依次返回每个 NAL 单元 (去掉起始码) 的 (起始, 结束) 偏移，buf 可以是 bytes 或 memoryview"""
+    if end is None: end = len(buf)
+    m = _START_CODE_RE.search(buf, start, end)
+    while m:
+        nal_start = m.end()
+        m = _START_CODE_RE.search(buf, nal_start, end)
+        if not m:
+            yield nal_start, end
+            return
+        # 4 字节起始码的前导 0 属于下一个 NAL
+        nxt = m.start()
+        nal_end = nxt - 1 if buf[nxt - 1] == 0 else nxt
+        yield nal_start, nal_end
+
+def nal_type(codec, header) -> int:
+    """根据 NAL 头第一个字节返回类型"""
+    if codec == HEVC:
+        return (header >> 1) & 0x3f
+    return header & 0x1f
+
+def is_vcl(codec, t) -> bool:
+    if codec == HEVC:
+        return t < 32
+    return 1 <= t <= 5
+
+def classify(buf, codec, start=0, end=None) -> FrameInfo:
+    """按第一个 VCL NAL 判断帧类型，参数集只在其之前查找"""
+    if end is None: end = len(buf)
+    param_sets = False
+    # 只定位起始码并读取 NAL 头，不查找 NAL 结尾，避免扫描整个 slice
+    pos = buf.find(START_CODE, start, end)
+    while 0 <= pos < end - 3:
+        t = nal_type(codec, buf[pos + 3])
+        if is_vcl(codec, t):
+            keyframe = t in HEVC_IRAP if codec == HEVC else t == H264_IDR
+            return FrameInfo(keyframe, param_sets, True)
+        if t in (HEVC_PARAM_SETS if codec == HEVC else H264_PARAM_SETS):
+            param_sets = True
+        pos = buf.find(START_CODE, pos + 3, end)
+    return FrameInfo(False, param_sets, False)
+
+def detect_codec(buf, start=0, end=None, max_nals=8):
+    """根据参数集的 NAL 头识别编码，未找到参数集时返回 None
+
+    HEVC 的 VPS/SPS 头为 40 01 / 42 01，在 H.264 中是未使用的类型；H.264 SPS (类型 7，nal_ref_idc 非 0)
+    在 HEVC 中是 nuh_layer_id 非 0 的保留类型，两者不会混淆。参数集位于关键帧开头，只检查前几个 NAL。
+    """
+    if end is None: end = len(buf)
+    pos = buf.find(START_CODE, start, end)
+    for _ in range(max_nals):
+        if not 0 <= pos < end - 4: break
+        header = buf[pos + 3]
+        if header in (0x40, 0x42) and buf[pos + 4] == 0x01:
+            return HEVC
+        if header & 0x9f == H264_SPS and header & 0x60:
+            return H264
+        pos = buf.find(START_CODE, pos + 3, end)
+    return None
+
+def param_sets(buf, codec, start=0, end=None):
+    """返回第一个 VCL NAL 之前的参数集 {NAL 类型: NAL 数据 (不含起始码)}"""
+    if end is None: end = len(buf)
+    types = HEVC_PARAM_SETS if codec == HEVC else H264_PARAM_SETS
+    found = {}
+    prev = None # 上一个 NAL 的 (类型, 起始偏移)，在找到下一个起始码时确定结尾
+    pos = buf.find(START_CODE, start, end)
+    while True:
+        if prev is not None and prev[0] in types:
+            nal_end = end if pos < 0 else (pos - 1 if buf[pos - 1] == 0 else pos)
+            found[prev[0]] = bytes(buf[prev[1]:nal_end])
+        if not 0 <= pos < end - 3: break
+        t = nal_type(codec, buf[pos + 3])
+        if is_vcl(codec, t): break
+        prev = (t, pos + 3)
+        pos = buf.find(START_CODE, pos + 3, end)
+    return found
+
+def annexb(nals) -> bytes:
+    """用 4 字节起始码拼接 NAL 单元"""
+    return b"".join(b"\x00\x00\x00\x01" + n for n in nals)
+
+# ---- 参数集解析 (只读取分辨率、档次/级别与帧率所需的字段) ----
+
+HEVC_PROFILES = {1: "Main", 2: "Main 10", 3: "Main Still Picture", 4: "Range Extensions"}
+H264_PROFILES = {66: "Baseline", 77: "Main", 88: "Extended", 100: "High", 110: "High 10", 122: "High 4:2:2", 244: "High 4:4:4"}
+# 带 chroma_format_idc 等扩展字段的 H.264 档次
+_H264_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+# chroma_format_idc -> (SubWidthC, SubHeightC)
+_CHROMA_SUBSAMPLING = {0: (1, 1), 1: (2, 2), 2: (2, 1), 3: (1, 1)}
+
+class StreamInfo(NamedTuple):
+    codec: str
+    profile: str
+    level: str
+    width: int
+    height: int
+    fps: float # VUI/VPS 中声明的帧率，未声明时为 0
+
+class BitReader:
+    """按位读取 RBSP，支持 Exp-Golomb 解码，读取越界时抛出 ValueError"""
+    def __init__(self, data):
+        self.value = int.from_bytes(data, "big")
+        self.size = len(data) * 8
+        self.pos = 0
+
+    def u(self, n) -> int:
+        if self.pos + n > self.size:
+            raise ValueError("Parameter set truncated")
+        self.pos += n
+        return (self.value >> (self.size - self.pos)) & ((1 << n) - 1)
+
+    def skip(self, n):
+        self.u(n)
+
+    def ue(self) -> int:
+        zeros = 0
+        while not self.u(1):
+            zeros += 1
+            if zeros > 31: raise ValueError("Invalid Exp-Golomb code")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self) -> int:
+        v = self.ue()
+        return (v + 1) // 2 if v & 1 else -(v // 2)
+
+def unescape_rbsp(data) -> bytes:
+    """去掉防竞争字节 (00 00 03 中的 03)"""
+    return bytes(data).replace(b"\x00\x00\x03", b"\x00\x00")
+
+def _hevc_profile_tier_level(r, max_sub_layers_minus1):
+    r.skip(2)
+    tier = r.u(1)
+    profile_idc = r.u(5)
+    r.skip(32 + 48)                  # compatibility flags / constraint flags
+    level_idc = r.u(8)
+    sub_layers = [(r.u(1), r.u(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1:
+        r.skip(2 * (8 - max_sub_layers_minus1))
+    for profile_present, level_present in sub_layers:
+        if profile_present: r.skip(88)
+        if level_present: r.skip(8)
+    profile = HEVC_PROFILES.get(profile_idc, str(profile_idc))
+    return f"{profile}{' High' if tier else ''}", f"{level_idc / 30:.1f}"
+
+def _hevc_scaling_list_data(r):
+    for size_id in range(4):
+        for _ in range(0, 6, 3 if size_id == 3 else 1):
+            if not r.u(1):
+                r.ue()                   # scaling_list_pred_matrix_id_delta
+                continue
+            if size_id > 1: r.se()       # scaling_list_dc_coef_minus8
+            for _ in range(min(64, 1 << (4 + (size_id << 1)))): r.se()
+
+def _hevc_st_ref_pic_sets(r, count):
+    num_delta_pocs = []
+    for idx in range(count):
+        if idx and r.u(1):
+            # inter_ref_pic_set_prediction: 以前一个集合为参考
+            r.skip(1); r.ue()
+            n = 0
+            for _ in range(num_delta_pocs[idx - 1] + 1):
+                if r.u(1) or r.u(1): n += 1 # used_by_curr_pic_flag / use_delta_flag
+            num_delta_pocs.append(n)
+            continue
+        negative, positive = r.ue(), r.ue()
+        for _ in range(negative + positive):
+            r.ue(); r.skip(1)
+        num_delta_pocs.append(negative + positive)
+
+def _vui_timing(r, codec) -> float:
+    """解析 VUI 到 timing_info 为止，返回帧率 (未声明为 0)"""
+    if r.u(1) and r.u(8) == 255: r.skip(32)        # aspect_ratio_info
+    if r.u(1): r.skip(1)                           # overscan_info
+    if r.u(1):                                     # video_signal_type
+        r.skip(4)
+        if r.u(1): r.skip(24)
+    if r.u(1): r.ue(); r.ue()                      # chroma_loc_info
+    if codec == HEVC:
+        r.skip(3)                                  # neutral_chroma / field_seq / frame_field_info
+        if r.u(1): r.ue(); r.ue(); r.ue(); r.ue()  # default_display_window
+    if not r.u(1): return 0.0
+    num_units_in_tick, time_scale = r.u(32), r.u(32)
+    if not num_units_in_tick: return 0.0
+    # H.264 的 tick 为半帧 (场)
+    return time_scale / num_units_in_tick / (2 if codec == H264 else 1)
+
+def _chroma_format_idc(r) -> int:
+    # 损坏的 SPS 可能读出超出范围的值，按解析失败处理
+    value = r.ue()
+    if value not in _CHROMA_SUBSAMPLING: raise ValueError(f"Invalid chroma_format_idc: {value}")
+    return value
+
+def _parse_hevc_sps(r) -> StreamInfo:
+    r.skip(4)
+    max_sub_layers_minus1 = r.u(3)
+    r.skip(1)
+    profile, level = _hevc_profile_tier_level(r, max_sub_layers_minus1)
+    r.ue()
+    chroma_format_idc = _chroma_format_idc(r)
+    if chroma_format_idc == 3: r.skip(1)
+    width, height = r.ue(), r.ue()
+    sub_w, sub_h = _CHROMA_SUBSAMPLING[chroma_format_idc]
+    if r.u(1):
+        left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+        width -= sub_w * (left + right)
+        height -= sub_h * (top + bottom)
+    info = StreamInfo(HEVC, profile, level, width, height, 0.0)
+
+    # 帧率位于 VUI，需要依次跳过之前的所有字段
+    r.ue(); r.ue()                                 # bit_depth
+    log2_max_poc_lsb = r.ue() + 4
+    ordering_all = r.u(1)
+    for _ in range(0 if ordering_all else max_sub_layers_minus1, max_sub_layers_minus1 + 1):
+        r.ue(); r.ue(); r.ue()
+    for _ in range(6): r.ue()                      # 编码块/变换块尺寸与层级
+    if r.u(1) and r.u(1): _hevc_scaling_list_data(r)
+    r.skip(2)                                      # amp / sao
+    if r.u(1):                                     # pcm
+        r.skip(8); r.ue(); r.ue(); r.skip(1)
+    _hevc_st_ref_pic_sets(r, r.ue())
+    if r.u(1):                                     # long_term_ref_pics
+        for _ in range(r.ue()): r.skip(log2_max_poc_lsb + 1)
+    r.skip(2)                                      # temporal_mvp / strong_intra_smoothing
+    if r.u(1): info = info._replace(fps=_vui_timing(r, HEVC))
+    return info
+
+def _parse_h264_sps(r) -> StreamInfo:
+    profile_idc = r.u(8)
+    constraints = r.u(8)
+    level_idc = r.u(8)
+    r.ue()
+    chroma_format_idc = 1
+    if profile_idc in _H264_HIGH_PROFILES:
+        chroma_format_idc = _chroma_format_idc(r)
+        if chroma_format_idc == 3: r.skip(1)
+        r.ue(); r.ue(); r.skip(1)                  # bit_depth / qpprime_y_zero_transform_bypass
+        if r.u(1):                                 # seq_scaling_matrix
+            for i in range(12 if chroma_format_idc == 3 else 8):
+                if not r.u(1): continue
+                last = next_scale = 8
+                for _ in range(16 if i < 6 else 64):
+                    if next_scale: next_scale = (last + r.se() + 256) % 256
+                    last = next_scale or last
+    r.ue()                                         # log2_max_frame_num_minus4
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()
+    elif poc_type == 1:
+        r.skip(1); r.se(); r.se()
+        for _ in range(r.ue()): r.se()
+    r.ue(); r.skip(1)                              # max_num_ref_frames / gaps_in_frame_num
+    mbs_w, map_units_h = r.ue() + 1, r.ue() + 1
+    frame_mbs_only = r.u(1)
+    if not frame_mbs_only: r.skip(1)
+    r.skip(1)                                      # direct_8x8_inference
+    width, height = mbs_w * 16, (2 - frame_mbs_only) * map_units_h * 16
+    if r.u(1):
+        left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+        sub_w, sub_h = _CHROMA_SUBSAMPLING[chroma_format_idc] if chroma_format_idc else (1, 1)
+        width -= sub_w * (left + right)
+        height -= sub_h * (2 - frame_mbs_only) * (top + bottom)
+    profile = H264_PROFILES.get(profile_idc, str(profile_idc))
+    if profile_idc == 66 and constraints & 0x40: profile = "Constrained Baseline"
+    fps = _vui_timing(r, H264) if r.u(1) else 0.0
+    return StreamInfo(H264, profile, f"{level_idc / 10:.1f}", width, height, fps)
+
+def parse_sps(nal, codec) -> StreamInfo:
+    """解析 SPS (含 NAL 头，不含起始码)，码流不完整或不合法时抛出 ValueError"""
+    header = 2 if codec == HEVC else 1
+    r = BitReader(unescape_rbsp(nal[header:]))
+    return _parse_hevc_sps(r) if codec == HEVC else _parse_h264_sps(r)
+
+def parse_vps_fps(nal) -> float:
+    """HEVC VPS 中声明的帧率 (SPS 的 VUI 未声明时使用)，未声明为 0"""
+    r = BitReader(unescape_rbsp(nal[2:]))
+    r.skip(12)
+    max_sub_layers_minus1 = r.u(3)
+    r.skip(17)
+    _hevc_profile_tier_level(r, max_sub_layers_minus1)
+    ordering_all = r.u(1)
+    for _ in range(0 if ordering_all else max_sub_layers_minus1, max_sub_layers_minus1 + 1):
+        r.ue(); r.ue(); r.ue()
+    max_layer_id = r.u(6)
+    r.skip((max_layer_id + 1) * r.ue())            # layer_id_included_flag
+    if not r.u(1): return 0.0
+    num_units_in_tick, time_scale = r.u(32), r.u(32)
+    return time_scale / num_units_in_tick if num_units_in_tick else 0.0
@@ -0,0 +1,60 @@
+import logging
+from typing import Optional
+from urllib.parse import quote, urlsplit
+
+import aiohttp
+
+logger = logging.getLogger("Bridge")
+
+# go2rtc 默认的 HTTP API 端口
+GO2RTC_API_PORT = 1984
+
+def go2rtc_streams_url(rtsp_url) -> str:
+    """由推流地址推导 go2rtc 查询该路流的接口: rtsp://host:8554/name -> http://host:1984/api/streams?src=name"""
+    parts = urlsplit(rtsp_url)
+    host = f"[{parts.hostname}]" if ":" in parts.hostname else parts.hostname
+    return f"http://{host}:{GO2RTC_API_PORT}/api/streams?src={quote(parts.path.lstrip('/'), safe='')}"
+
+def parse_consumers(data) -> int:
+    """观看者数量: go2rtc 的流信息 ({"consumers": [...]}，无观看者时可能为 null)，或直接返回的数字"""
+    if isinstance(data, dict):
+        data = data.get("consumers")
+        if data is None: return 0
+    if isinstance(data, list): return len(data)
+    if isinstance(data, (int, float)) and not isinstance(data, bool): return int(data)
+    raise ValueError(f"Unexpected consumers response: {str(data)[:100]}")
+
+class ConsumerMonitor:
+    """查询 RTSP 服务器上各路流的观看者数量，供按需推流使用
+
+    接口可以是 go2rtc 的 /api/streams?src=<name>，也可以是任何返回 {"consumers": [...]}、
+    {"consumers": N} 或纯数字的 HTTP 地址。所有摄像头共享一个实例与 HTTP 会话。
+    """
+    def __init__(self, timeout=2.0):
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._failing = set()
+
+    async def count(self, url) -> Optional[int]:
+        """返回观看者数量，查询失败时返回 None (调用方保持当前状态)"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            async with self.session.get(url) as resp:
+                resp.raise_for_status()
+                consumers = parse_consumers(await resp.json(content_type=None))
+        except Exception as e:
+            # 每秒都会查询，只在开始失败时记录一次
+            if url not in self._failing:
+                self._failing.add(url)
+                logger.warning(f"Consumer query failed ({url}): {e!r}")
+            return None
+        if url in self._failing:
+            self._failing.discard(url)
+            logger.info(f"Consumer query recovered ({url})")
+        return consumers
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
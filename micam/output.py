@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+import logging
+import collections
+from typing import Optional
+
+logger = logging.getLogger("Bridge")
+
+# 输出队列溢出策略
+DROP_NEWEST = "newest"      # 丢弃新到的数据
+DROP_OLDEST = "oldest"      # 丢弃队列中最旧的数据
+DROP_KEYFRAME = "keyframe"  # 丢弃直到下一个关键帧，保证解码器看到完整 GOP
+DROP_POLICIES = (DROP_NEWEST, DROP_OLDEST, DROP_KEYFRAME)
+
+class FrameQueue:
+    """按字节数限制的输出队列
+
+    write() 永不阻塞 WS 接收，超出容量时按 policy 丢弃数据并计数。
+    子类实现 _flush 把队首数据写出，暂时无法写出时设置 _waiting 并在可写时再次调用 _flush。
+    """
+    def __init__(self, name, max_bytes=2 * 1024 * 1024, policy=DROP_NEWEST):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.name = name
+        self.queue = collections.deque() # (data, keyframe, 到达时刻)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.queued_bytes = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self.written_bytes = 0
+        self.on_write = None # 成功写出后的回调
+        self.running = True
+        self._waiting = False # 正在等待可写
+        self._partial = False # 队首数据已写出一部分，不能丢弃
+        self._resync = False  # keyframe 策略: 正在等待下一个关键帧
+        self._drop_logged = 0.0
+
+    def write(self, data, keyframe=False, at=None) -> bool:
+        """非阻塞入队，返回数据是否被接受
+
+        at 为数据的到达时刻 (time.monotonic)，RTP 输出据此生成时间戳；为空时取写出时刻。
+        """
+        if not self.running: return False
+        size = len(data)
+        if self._resync:
+            if not keyframe: return self._drop(size, log=False)
+            self._resync = False
+        if self.queued_bytes + size > self.max_bytes and not self._make_room(size, keyframe):
+            if self.policy == DROP_KEYFRAME: self._resync = True
+            return self._drop(size)
+
+        self.queue.append((data, keyframe, at))
+        self.queued_bytes += size
+        if not self._waiting:
+            self._flush()
+        return True
+
+    def resync(self):
+        """丢弃后续数据直到下一个关键帧 (新的输出或 WS 重连后使用)"""
+        self._resync = True
+
+    def _make_room(self, size, keyframe) -> bool:
+        """按策略丢弃队列中的旧数据，返回是否腾出了足够空间"""
+        if self.policy == DROP_NEWEST: return False
+        # keyframe 策略下，新关键帧之前积压的数据都属于上一个 GOP 的尾部，可以整体丢弃
+        if self.policy == DROP_KEYFRAME and not keyframe: return False
+        keep = 1 if self._partial else 0
+        while len(self.queue) > keep and self.queued_bytes + size > self.max_bytes:
+            if self.policy == DROP_KEYFRAME:
+                # 从队尾丢弃，剩余部分仍是可解码的连续前缀
+                old = self.queue.pop()[0]
+            else:
+                # 正在写入的队首必须写完，从它之后开始丢弃
+                old = self.queue[keep][0]
+                del self.queue[keep]
+            self.queued_bytes -= len(old)
+            self._drop(len(old))
+        return self.queued_bytes + size <= self.max_bytes
+
+    def _drop(self, size, log=True) -> bool:
+        self.dropped_frames += 1
+        self.dropped_bytes += size
+        # 拥塞时每帧都可能丢弃，日志限频
+        now = time.monotonic()
+        if log and now - self._drop_logged >= 5:
+            self._drop_logged = now
+            logger.warning(f"[{self.name}] Queue full ({self.queued_bytes} bytes, {self.policy}), dropped {self.dropped_frames} frames so far")
+        return False
+
+    def _flush(self):
+        raise NotImplementedError
+
+    def close(self):
+        self.running = False
+        self.queue.clear()
+        self.queued_bytes = 0
+
+class PipeWriter(FrameQueue):
+    """非阻塞写入命名管道
+
+    不再为每路流启动线程，所有摄像头的管道都注册到同一个事件循环 (epoll)，
+    管道可写时由 add_writer 回调继续写入。
+    """
+    def __init__(self, pipe_path, name, max_bytes=2 * 1024 * 1024, policy=DROP_NEWEST):
+        super().__init__(name, max_bytes, policy)
+        self.pipe_path = pipe_path
+        self.fd = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ensure_pipe()
+
+    def _ensure_pipe(self):
+        try:
+            if os.path.exists(self.pipe_path):
+                os.remove(self.pipe_path)
+            os.mkfifo(self.pipe_path)
+            # O_RDWR 防止 Linux/macOS 上 open 阻塞
+            self.fd = os.open(self.pipe_path, os.O_RDWR | os.O_NONBLOCK)
+            logger.info(f"[{self.name}] Pipe opened: {self.pipe_path}")
+        except Exception as e:
+            logger.error(f"[{self.name}] Failed to create/open pipe: {e}")
+            self.running = False
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+
+    def _flush(self):
+        while self.queue:
+            data, keyframe, at = self.queue[0]
+            try:
+                n = os.write(self.fd, data)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                logger.error(f"[{self.name}] Write error: {e}")
+                self.close()
+                return
+            self.queued_bytes -= n
+            self.written_bytes += n
+            if self.on_write: self.on_write()
+            if n < len(data):
+                # 管道已满，只写入了一部分，剩余部分等待下次可写 (memoryview 切片不复制)
+                self.queue[0] = (memoryview(data)[n:], keyframe, at)
+                self._partial = True
+                break
+            self.queue.popleft()
+            self._partial = False
+
+        if self.queue and not self._waiting:
+            self.loop.add_writer(self.fd, self._flush)
+            self._waiting = True
+        elif not self.queue and self._waiting:
+            self.loop.remove_writer(self.fd)
+            self._waiting = False
+
+    def close(self):
+        super().close()
+        if self._waiting:
+            self.loop.remove_writer(self.fd)
+            self._waiting = False
+        if self.fd:
+            try: os.close(self.fd)
+            except: pass
+            self.fd = None
+        if os.path.exists(self.pipe_path):
+            try: os.remove(self.pipe_path)
+            except: pass
+
+class GopBuffer:
+    """按字节限制的 GOP 缓存: 保存从最近一个关键帧开始的视频
+
+    新的输出启动时先送入缓存内容，立即从最近的关键帧开始，无需等待下一个关键帧。
+    每帧记录到达时刻，内置推流按原有间隔生成时间戳。音频不缓存: 音频时间戳按样本数生成，缓存的音频会比实时数据超前整个 GOP 的时长。
+    缓存的是 WS 消息的 memoryview，不复制数据。GOP 超出容量时无法从中间开始解码，整体丢弃直到下一个关键帧。
+    """
+    def __init__(self, max_bytes=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.items = [] # (负载, FrameInfo, 到达时刻)
+        self.bytes = 0
+        self.keyframe_at = 0.0
+        self.overflows = 0
+
+    def add_video(self, payload, info):
+        now = time.monotonic()
+        if info.keyframe:
+            self.clear()
+            self.keyframe_at = now
+        elif not self.items:
+            return
+        self.items.append((payload, info, now))
+        self.bytes += len(payload)
+        if self.bytes > self.max_bytes:
+            self.overflows += 1
+            self.clear()
+
+    def clear(self):
+        self.items = []
+        self.bytes = 0
+        self.keyframe_at = 0.0
@@ -0,0 +1,314 @@
+"""内置 RTSP 推流: ANNOUNCE/SETUP/RECORD，RTP over TCP interleaved
+
+视频透传与音频重封装不需要 ffmpeg:
+- HEVC 按 RFC 7798、H.264 按 RFC 6184 打包 (单 NAL 包或 FU 分片)
+- 音频 G.711A 直接作为 PCMA 发送，或查表解码为 L16
+
+每路流是一个 FrameQueue，写入接口与 PipeWriter 相同。RTSP 连接建立前以及
+TCP 发送缓冲区超过上限时数据留在队列中，按同样的策略丢弃。
+"""
+import re
+import time
+import base64
+import random
+import struct
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+from urllib.parse import urlsplit, unquote
+
+from . import nal
+from .g711 import alaw_to_l16
+from .output import FrameQueue, DROP_KEYFRAME, DROP_NEWEST
+
+logger = logging.getLogger("Bridge")
+
+AUDIO_L16 = "l16"
+AUDIO_PCMA = "pcma"
+AUDIO_CODECS = (AUDIO_L16, AUDIO_PCMA)
+
+MAX_PAYLOAD = 1400          # 服务器可能用 UDP 转发给播放端，RTP 负载不超过常见 MTU
+VIDEO_CLOCK_RATE = 90000
+AUDIO_PACKET_SAMPLES = 320  # 20ms
+WRITE_BUFFER_HIGH = 256 * 1024
+REPORT_INTERVAL = 5.0
+
+_RTP_HEADER = struct.Struct("!cBHBBHII") # interleaved 头 + RTP 头
+
+class RTPTrack(FrameQueue):
+    def __init__(self, publisher, name, channel, payload_type, clock_rate, max_bytes, policy):
+        super().__init__(name, max_bytes, policy)
+        self.publisher = publisher
+        self.channel = channel
+        self.payload_type = payload_type
+        self.clock_rate = clock_rate
+        self.seq = random.getrandbits(16)
+        self.ssrc = random.getrandbits(32)
+        self.ts_base = random.getrandbits(32)
+        self.packets = 0
+        self.octets = 0
+        self.last_ts = None
+        self.last_sent = 0.0
+        self._waiting = True # 连接建立后由 publisher 开始发送
+
+    def rtp_time(self, now) -> int:
+        return (self.ts_base + int((now - self.publisher.start_time) * self.clock_rate)) & 0xffffffff
+
+    def _send(self, parts, ts, marker=False):
+        size = sum(len(p) for p in parts)
+        header = _RTP_HEADER.pack(b"$", self.channel, 12 + size, 0x80, (marker << 7) | self.payload_type, self.seq, ts, self.ssrc)
+        self.publisher.transport.write(b"".join((header, *parts)))
+        self.seq = (self.seq + 1) & 0xffff
+        self.packets += 1
+        self.octets += size
+        self.last_ts = ts
+        self.last_sent = time.monotonic()
+
+    def _flush(self):
+        while self.queue and not self.publisher.paused:
+            data, _, at = self.queue.popleft()
+            self.queued_bytes -= len(data)
+            self._packetize(data, at)
+            self.written_bytes += len(data)
+            if self.on_write: self.on_write()
+        self._waiting = self.publisher.paused
+
+    def _packetize(self, data, at):
+        raise NotImplementedError
+
+    def sender_report(self) -> Optional[bytes]:
+        """RTCP SR，把 RTP 时间戳映射到墙上时间，供接收端同步音视频"""
+        if self.last_ts is None: return None
+        now = time.monotonic()
+        ts = (self.last_ts + int((now - self.last_sent) * self.clock_rate)) & 0xffffffff
+        ntp = time.time() + 2208988800
+        sec = int(ntp)
+        rtcp = struct.pack("!BBHIIIIII", 0x80, 200, 6, self.ssrc, sec & 0xffffffff, int((ntp - sec) * (1 << 32)) & 0xffffffff,
+                           ts, self.packets & 0xffffffff, self.octets & 0xffffffff)
+        return struct.pack("!cBH", b"$", self.channel + 1, len(rtcp)) + rtcp
+
+class VideoTrack(RTPTrack):
+    """每项数据为一个访问单元，所有 NAL 共用写出时刻 (或指定的到达时刻) 的时间戳，最后一个包置 marker"""
+    def __init__(self, publisher, name, codec, max_bytes, policy):
+        super().__init__(publisher, name, 0, 96, VIDEO_CLOCK_RATE, max_bytes, policy)
+        self.codec = codec
+        self.header_size = 2 if codec == nal.HEVC else 1
+
+    def _packetize(self, data, at):
+        # 缓存的 GOP 一次写入，按各帧到达时刻保留原有间隔，否则时间戳挤在同一时刻
+        ts = self.rtp_time(at or time.monotonic())
+        buf = memoryview(data)
+        units = [(s, e) for s, e in nal.iter_nal_units(buf) if e - s > self.header_size]
+        for i, (s, e) in enumerate(units):
+            self._send_nal(buf[s:e], ts, i == len(units) - 1)
+        # RTCP SR 由 last_sent 推算当前的 RTP 时间
+        if at: self.last_sent = at
+
+    def _send_nal(self, unit, ts, last):
+        if len(unit) <= MAX_PAYLOAD:
+            self._send((unit,), ts, last)
+            return
+        if self.codec == nal.HEVC:
+            # RFC 7798 FU: 负载头类型为 49，FU 头携带原 NAL 类型
+            h0 = unit[0]
+            head = bytes(((h0 & 0x81) | (49 << 1), unit[1]))
+            t = (h0 >> 1) & 0x3f
+        else:
+            # RFC 6184 FU-A: FU indicator 保留 NRI，类型为 28
+            h0 = unit[0]
+            head = bytes(((h0 & 0xe0) | 28,))
+            t = h0 & 0x1f
+        step = MAX_PAYLOAD - len(head) - 1
+        pos, end = self.header_size, len(unit)
+        while pos < end:
+            nxt = min(pos + step, end)
+            fu = (0x80 if pos == self.header_size else 0) | (0x40 if nxt == end else 0) | t
+            self._send((head, bytes((fu,)), unit[pos:nxt]), ts, last and nxt == end)
+            pos = nxt
+
+class AudioTrack(RTPTrack):
+    """时间戳按样本数累加，与 ffmpeg 路径的 asetpts=N/SR/TB 一致"""
+    def __init__(self, publisher, name, codec, sample_rate, max_bytes):
+        # 音频为裸 PCM，任意位置丢弃都不影响解码
+        super().__init__(publisher, name, 2, 97, sample_rate, max_bytes, DROP_NEWEST)
+        self.codec = codec
+        self.next_ts = None
+
+    def _packetize(self, data, at):
+        if self.next_ts is None: self.next_ts = self.rtp_time(time.monotonic())
+        buf = memoryview(data)
+        for pos in range(0, len(buf), AUDIO_PACKET_SAMPLES):
+            chunk = buf[pos:pos + AUDIO_PACKET_SAMPLES]
+            self._send((chunk if self.codec == AUDIO_PCMA else alaw_to_l16(chunk),), self.next_ts)
+            self.next_ts = (self.next_ts + len(chunk)) & 0xffffffff
+
+class RTSPPublisher(asyncio.Protocol):
+    """单个 RTSP 推流连接，断开后由调用方重新创建"""
+    def __init__(self, url, video_codec, name, param_sets=None, audio_codec=AUDIO_L16, audio_sample_rate=16000,
+                 video_queue_bytes=2 * 1024 * 1024, audio_queue_bytes=64 * 1024, drop_policy=DROP_KEYFRAME, timeout=10.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 554
+        self.username = unquote(parts.username or "")
+        self.password = unquote(parts.password or "")
+        netloc = f"[{self.host}]" if ":" in self.host else self.host
+        if parts.port: netloc += f":{parts.port}"
+        self.url = f"rtsp://{netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+        self.name = name
+        self.video_codec = video_codec
+        self.param_sets = dict(param_sets or {})
+        self.audio_codec = audio_codec
+        self.audio_sample_rate = audio_sample_rate
+        self.timeout = timeout
+        self.video = VideoTrack(self, f"{name}/Video", video_codec, video_queue_bytes, drop_policy)
+        self.audio = AudioTrack(self, f"{name}/Audio", audio_codec, audio_sample_rate, audio_queue_bytes)
+        self.tracks = (self.video, self.audio)
+        self.transport: Optional[asyncio.Transport] = None
+        self.paused = True
+        self.connected = False
+        self.start_time = time.monotonic()
+        self.cseq = 0
+        self.session = None
+        self._authorization = None
+        self._buf = bytearray()
+        self._response: Optional[asyncio.Future] = None
+        self._closed: Optional[asyncio.Future] = None
+        self._report_task: Optional[asyncio.Task] = None
+
+    # --- asyncio.Protocol ---
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+
+    def connection_lost(self, exc):
+        self.paused = True
+        self.connected = False
+        error = exc or ConnectionError("RTSP connection closed")
+        if self._response and not self._response.done(): self._response.set_exception(error)
+        if not self._closed.done(): self._closed.set_result(exc)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        if not self.connected: return
+        self.paused = False
+        for track in self.tracks: track._flush()
+
+    def data_received(self, data):
+        buf = self._buf
+        buf += data
+        while buf:
+            if buf[0] == 0x24:
+                # 服务器发来的 interleaved RTCP (RR)，直接丢弃
+                if len(buf) < 4 or len(buf) < 4 + int.from_bytes(buf[2:4], "big"): return
+                del buf[:4 + int.from_bytes(buf[2:4], "big")]
+                continue
+            end = buf.find(b"\r\n\r\n")
+            if end < 0: return
+            lines = buf[:end].decode(errors="replace").split("\r\n")
+            headers = {}
+            for line in lines[1:]:
+                k, _, v = line.partition(":")
+                headers.setdefault(k.strip().lower(), []).append(v.strip())
+            length = int(headers.get("content-length", ["0"])[0])
+            if len(buf) < end + 4 + length: return
+            del buf[:end + 4 + length]
+            status = lines[0].split(" ", 2)
+            if status[0].startswith("RTSP/") and self._response and not self._response.done():
+                self._response.set_result((int(status[1]), headers))
+
+    # --- RTSP ---
+
+    async def request(self, method, url, headers=None, body=b""):
+        for attempt in range(2):
+            self.cseq += 1
+            lines = [f"{method} {url} RTSP/1.0", f"CSeq: {self.cseq}", "User-Agent: micam"]
+            if self.session: lines.append(f"Session: {self.session}")
+            if self._authorization: lines.append(f"Authorization: {self._authorization(method, url)}")
+            lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+            if body: lines.append(f"Content-Length: {len(body)}")
+            self._response = asyncio.get_running_loop().create_future()
+            self.transport.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+            code, resp = await asyncio.wait_for(self._response, self.timeout)
+            if code == 401 and attempt == 0 and self.username and not self._authorization:
+                self._authorization = self._authenticator(resp.get("www-authenticate", []))
+                continue
+            if code != 200:
+                raise ConnectionError(f"RTSP {method} failed: {code}")
+            return resp
+
+    def _authenticator(self, challenges):
+        """优先使用 Digest 认证，否则使用 Basic"""
+        for challenge in challenges:
+            if challenge.lower().startswith("digest"):
+                params = dict(re.findall(r'(\w+)="?([^",]*)"?', challenge[6:]))
+                realm, nonce = params.get("realm", ""), params.get("nonce", "")
+                def md5(s): return hashlib.md5(s.encode()).hexdigest()
+                ha1 = md5(f"{self.username}:{realm}:{self.password}")
+                def digest(method, uri):
+                    response = md5(f"{ha1}:{nonce}:{md5(method + ':' + uri)}")
+                    return (f'Digest username="{self.username}", realm="{realm}", nonce="{nonce}", uri="{uri}", '
+                            f'response="{response}"')
+                return digest
+        token = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+        return lambda method, uri: f"Basic {token}"
+
+    def _sdp(self) -> bytes:
+        b64 = lambda data: base64.b64encode(data).decode()
+        lines = ["v=0", "o=- 0 0 IN IP4 127.0.0.1", "s=micam", f"c=IN IP4 {self.host}", "t=0 0", "a=tool:micam"]
+        lines.append("m=video 0 RTP/AVP 96")
+        if self.video_codec == nal.HEVC:
+            lines.append("a=rtpmap:96 H265/90000")
+            sprop = [f"sprop-{k}={b64(self.param_sets[t])}" for k, t in
+                     (("vps", nal.HEVC_VPS), ("sps", nal.HEVC_SPS), ("pps", nal.HEVC_PPS)) if t in self.param_sets]
+            if sprop: lines.append(f"a=fmtp:96 {'; '.join(sprop)}")
+        else:
+            lines.append("a=rtpmap:96 H264/90000")
+            fmtp = ["packetization-mode=1"]
+            sps, pps = self.param_sets.get(nal.H264_SPS), self.param_sets.get(nal.H264_PPS)
+            if sps and pps:
+                fmtp.append(f"sprop-parameter-sets={b64(sps)},{b64(pps)}")
+                fmtp.append(f"profile-level-id={sps[1:4].hex().upper()}")
+            lines.append(f"a=fmtp:96 {'; '.join(fmtp)}")
+        lines.append("a=control:streamid=0")
+        lines.append("m=audio 0 RTP/AVP 97")
+        lines.append(f"a=rtpmap:97 {'PCMA' if self.audio_codec == AUDIO_PCMA else 'L16'}/{self.audio_sample_rate}/1")
+        lines.append("a=control:streamid=1")
+        return ("\r\n".join(lines) + "\r\n").encode()
+
+    async def connect(self):
+        """建立连接并完成 ANNOUNCE/SETUP/RECORD，之后开始发送队列中的数据"""
+        loop = asyncio.get_running_loop()
+        self._closed = loop.create_future()
+        await asyncio.wait_for(loop.create_connection(lambda: self, self.host, self.port), self.timeout)
+        await self.request("ANNOUNCE", self.url, {"Content-Type": "application/sdp"}, self._sdp())
+        for i, track in enumerate(self.tracks):
+            transport = f"RTP/AVP/TCP;unicast;interleaved={track.channel}-{track.channel + 1};mode=record"
+            resp = await self.request("SETUP", f"{self.url}/streamid={i}", {"Transport": transport})
+            if not self.session: self.session = resp.get("session", [""])[0].split(";")[0] or None
+        await self.request("RECORD", self.url, {"Range": "npt=0.000-"})
+        self.connected = True
+        self.paused = False
+        for track in self.tracks: track._flush()
+        self._report_task = asyncio.ensure_future(self._send_reports())
+
+    async def _send_reports(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            if self.paused: continue
+            for track in self.tracks:
+                report = track.sender_report()
+                if report: self.transport.write(report)
+
+    async def wait_closed(self):
+        await self._closed
+
+    def close(self):
+        if self._report_task: self._report_task.cancel()
+        for track in self.tracks: track.close()
+        if self.transport: self.transport.close()
+        self.connected = False
+        self.paused = True
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from micam.capture import CaptureReader, CaptureWriter
+
+MESSAGES = [b"\x01" + bytes([i]) * (i * 37) for i in range(20)]
+
+def write_capture(path, messages=MESSAGES, **meta):
+    with CaptureWriter(path, **meta) as w:
+        for m in messages:
+            w.write(m)
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "a.mcap")
+    write_capture(path, camera="cam1", channel=0)
+    with CaptureReader(path) as r:
+        assert r.complete
+        assert r.meta["camera"] == "cam1"
+        assert r.meta["channel"] == 0
+        assert "started_at" in r.meta
+        assert len(r) == len(MESSAGES)
+        assert [bytes(m) for _, m in r] == MESSAGES
+        ts = [t for t, _ in r]
+        assert ts == sorted(ts)
+        assert r.duration == ts[-1]
+        assert bytes(r[5][1]) == MESSAGES[5]
+        assert bytes(r[-1][1]) == MESSAGES[-1]
+
+def test_empty_capture(tmp_path):
+    path = str(tmp_path / "empty.mcap")
+    write_capture(path, messages=[])
+    with CaptureReader(path) as r:
+        assert r.complete
+        assert len(r) == 0
+        assert r.duration == 0.0
+
+def test_rebuild_index_without_trailer(tmp_path):
+    path = str(tmp_path / "b.mcap")
+    w = CaptureWriter(path)
+    for m in MESSAGES:
+        w.write(m)
+    # 模拟录制进程异常退出: 没有索引与尾部，最后一条记录不完整
+    w.file.flush()
+    size = os.path.getsize(path)
+    w.file.close()
+    w.file = None
+    os.truncate(path, size - 5)
+    with CaptureReader(path) as r:
+        assert not r.complete
+        assert [bytes(m) for _, m in r] == MESSAGES[:-1]
+
+def test_writer_close_is_idempotent(tmp_path):
+    path = str(tmp_path / "d.mcap")
+    w = CaptureWriter(path)
+    w.write(b"x")
+    w.close()
+    w.close()
+    w.write(b"y")
+    with CaptureReader(path) as r:
+        assert [bytes(m) for _, m in r] == [b"x"]
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "e.mcap"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(ValueError):
+        CaptureReader(str(path))
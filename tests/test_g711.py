@@ -0,0 +1,53 @@
+import array
+import struct
+
+import pytest
+
+from micam import g711
+
+def test_decode_table_is_symmetric():
+    assert len(set(g711.ALAW_TO_LINEAR)) == 256
+    for v in range(256):
+        assert g711.alaw_decode(v) == -g711.alaw_decode(v ^ 0x80)
+    assert max(g711.ALAW_TO_LINEAR) == 32256
+    assert min(g711.ALAW_TO_LINEAR) == -32256
+
+def test_encode_decode_roundtrip():
+    for v in range(256):
+        assert g711.alaw_encode(g711.alaw_decode(v)) == v
+
+@pytest.mark.parametrize("sample", [-32768, -1000, -1, 0, 1, 1000, 32767])
+def test_encode_quantization_error(sample):
+    decoded = g711.alaw_decode(g711.alaw_encode(sample))
+    # 最高段量化步长为 1024
+    assert abs(decoded - sample) <= 1024
+    assert (decoded >= 0) == (sample >= 0)
+
+def test_alaw_to_l16_is_big_endian():
+    data = bytes(range(256))
+    assert g711.alaw_to_l16(data) == struct.pack(">256h", *g711.ALAW_TO_LINEAR)
+    assert g711.alaw_to_l16(memoryview(data)[10:20]) == struct.pack(">10h", *g711.ALAW_TO_LINEAR[10:20])
+    assert g711.alaw_to_l16(b"") == b""
+
+def test_alaw_to_pcm():
+    data = bytes(range(256))
+    assert list(g711.alaw_to_pcm(data)) == list(g711.ALAW_TO_LINEAR)
+
+def test_alaw_levels():
+    data = bytes([0xd5, 0x55, 0x2a, 0xaa, 0x00, 0x80] * 50)
+    pcm = [g711.alaw_decode(v) for v in data]
+    assert g711.alaw_levels(data) == (len(pcm), sum(v * v for v in pcm), max(abs(v) for v in pcm))
+    assert g711.alaw_levels(memoryview(data)) == g711.alaw_levels(data)
+    assert g711.alaw_levels(b"") == (0, 0, 0)
+
+def test_alaw_levels_silence():
+    # 0xd5 / 0x55 是最接近 0 的码值 (±8)
+    assert g711.alaw_levels(b"\xd5" * 160) == (160, 160 * 64, 8)
+
+def test_alaw_levels_matches_pcm():
+    data = bytes(range(256)) * 4
+    pcm = array.array('h', g711.alaw_to_pcm(data))
+    n, squares, peak = g711.alaw_levels(data)
+    assert n == len(pcm)
+    assert squares == sum(v * v for v in pcm)
+    assert peak == max(abs(v) for v in pcm)
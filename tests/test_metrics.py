@@ -0,0 +1,39 @@
+from micam.metrics import Histogram, render
+
+def test_histogram():
+    h = Histogram(buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 2.0):
+        h.observe(v)
+    assert h.cumulative() == [(0.1, 2), (1.0, 3), (None, 4)]
+    assert (h.count, h.sum) == (4, 2.65)
+
+def test_render_merges_families_and_escapes_labels():
+    text = render([
+        ("micam_frames_total", "counter", "Frames received", {"camera": "cam1"}, 10),
+        ("micam_fps", "gauge", "Frames per second", {"camera": 'a"b\\c'}, 12.5),
+        ("micam_frames_total", "counter", "Frames received", {"camera": "cam2"}, 3),
+        ("micam_up", "gauge", "Up", {}, 1),
+    ])
+    assert text == (
+        "# HELP micam_frames_total Frames received\n"
+        "# TYPE micam_frames_total counter\n"
+        'micam_frames_total{camera="cam1"} 10\n'
+        'micam_frames_total{camera="cam2"} 3\n'
+        "# HELP micam_fps Frames per second\n"
+        "# TYPE micam_fps gauge\n"
+        'micam_fps{camera="a\\"b\\\\c"} 12.5\n'
+        "# HELP micam_up Up\n"
+        "# TYPE micam_up gauge\n"
+        "micam_up 1\n"
+    )
+
+def test_render_histogram():
+    h = Histogram(buckets=(0.5,))
+    h.observe(0.25)
+    text = render([("micam_latency_seconds", "histogram", "Latency", {"camera": "cam1"}, h)])
+    assert text.splitlines()[2:] == [
+        'micam_latency_seconds_bucket{camera="cam1",le="0.5"} 1',
+        'micam_latency_seconds_bucket{camera="cam1",le="+Inf"} 1',
+        'micam_latency_seconds_sum{camera="cam1"} 0.25',
+        'micam_latency_seconds_count{camera="cam1"} 1',
+    ]
@@ -0,0 +1,87 @@
+import pytest
+
+from micam import nal
+
+# libx264/libx265 编码 testsrc 得到的参数集 (不含起始码)
+H264_SPS_1080P = bytes.fromhex("67640028acd940780227e5c044000003000400000300c83c60c658")
+H264_SPS_444 = bytes.fromhex("67f4000c919b28283f60220000030002000003003c1e28532c")
+HEVC_VPS = bytes.fromhex("40010c01ffff01600000030090000003000003003f959809")
+HEVC_SPS_360P = bytes.fromhex("42010101600000030090000003000003003fa00502016965959a4932bc05a020000003002000000303c1")
+
+H264_PPS = b"\x68\xeb\xe3\xcb\x22\xc0"
+H264_IDR = b"\x65\x88\x84\x00\x10"
+H264_P = b"\x41\x9a\x02\x04"
+HEVC_PPS = b"\x44\x01\xc1\x72\xb4"
+HEVC_IDR = b"\x26\x01\xaf\x00\x10"
+HEVC_TRAIL = b"\x02\x01\xd0\x08"
+
+def test_iter_nal_units_mixed_start_codes():
+    buf = b"\x00\x00\x00\x01" + H264_SPS_1080P + b"\x00\x00\x01" + H264_PPS + b"\x00\x00\x00\x01" + H264_IDR
+    units = [buf[s:e] for s, e in nal.iter_nal_units(buf)]
+    assert units == [H264_SPS_1080P, H264_PPS, H264_IDR]
+
+def test_iter_nal_units_range_and_memoryview():
+    frame = nal.annexb([H264_SPS_1080P, H264_PPS])
+    buf = memoryview(b"\x01\xff" + frame)
+    units = [bytes(buf[s:e]) for s, e in nal.iter_nal_units(buf, 2)]
+    assert units == [H264_SPS_1080P, H264_PPS]
+    assert list(nal.iter_nal_units(b"no start code")) == []
+
+@pytest.mark.parametrize("codec, nals, expected", [
+    (nal.H264, [H264_SPS_1080P, H264_PPS, H264_IDR], (True, True, True)),
+    (nal.H264, [H264_IDR], (True, False, True)),
+    (nal.H264, [H264_P], (False, False, True)),
+    (nal.H264, [H264_SPS_1080P, H264_PPS], (False, True, False)),
+    (nal.HEVC, [HEVC_VPS, HEVC_SPS_360P, HEVC_PPS, HEVC_IDR], (True, True, True)),
+    (nal.HEVC, [HEVC_TRAIL], (False, False, True)),
+])
+def test_classify(codec, nals, expected):
+    info = nal.classify(nal.annexb(nals), codec)
+    assert tuple(info) == expected
+    assert info.random_access == (info.keyframe or info.param_sets)
+
+def test_classify_stops_at_first_vcl():
+    # 第一个 VCL 之后的参数集与 IDR 不影响结果
+    buf = nal.annexb([H264_P, H264_SPS_1080P, H264_IDR])
+    assert nal.classify(buf, nal.H264) == nal.FrameInfo(False, False, True)
+
+def test_detect_codec():
+    assert nal.detect_codec(nal.annexb([H264_SPS_1080P, H264_PPS, H264_IDR])) == nal.H264
+    assert nal.detect_codec(nal.annexb([HEVC_VPS, HEVC_SPS_360P, HEVC_PPS, HEVC_IDR])) == nal.HEVC
+    assert nal.detect_codec(nal.annexb([H264_P])) is None
+    assert nal.detect_codec(nal.annexb([HEVC_TRAIL])) is None
+
+def test_param_sets():
+    buf = nal.annexb([H264_SPS_1080P, H264_PPS, H264_IDR])
+    assert nal.param_sets(buf, nal.H264) == {nal.H264_SPS: H264_SPS_1080P, nal.H264_PPS: H264_PPS}
+    buf = nal.annexb([HEVC_VPS, HEVC_SPS_360P, HEVC_PPS, HEVC_IDR])
+    assert nal.param_sets(buf, nal.HEVC) == {nal.HEVC_VPS: HEVC_VPS, nal.HEVC_SPS: HEVC_SPS_360P, nal.HEVC_PPS: HEVC_PPS}
+    # 参数集位于帧末尾时结尾为 end
+    assert nal.param_sets(nal.annexb([H264_SPS_1080P]), nal.H264) == {nal.H264_SPS: H264_SPS_1080P}
+    assert nal.param_sets(nal.annexb([H264_IDR, H264_SPS_1080P]), nal.H264) == {}
+
+def test_unescape_rbsp():
+    assert nal.unescape_rbsp(b"\x00\x00\x03\x01\x00\x00\x03\x00") == b"\x00\x00\x01\x00\x00\x00"
+
+def test_bit_reader_exp_golomb():
+    # 1 | 010 | 011 | 00100 | 00101 -> ue 0, 1, 2, 3 与 se -2
+    r = nal.BitReader(bytes([0b10100110, 0b01000010, 0b10000000]))
+    assert [r.ue(), r.ue(), r.ue(), r.ue()] == [0, 1, 2, 3]
+    assert r.se() == -2
+
+def test_parse_h264_sps():
+    # 1080p 按 16 对齐编码为 1088 行，依靠 frame cropping 还原
+    assert nal.parse_sps(H264_SPS_1080P, nal.H264) == nal.StreamInfo("h264", "High", "4.0", 1920, 1080, 25.0)
+    assert nal.parse_sps(H264_SPS_444, nal.H264) == nal.StreamInfo("h264", "High 4:4:4", "1.2", 320, 240, 15.0)
+
+def test_parse_hevc_sps():
+    assert nal.parse_sps(HEVC_SPS_360P, nal.HEVC) == nal.StreamInfo("hevc", "Main", "2.1", 640, 360, 30.0)
+
+def test_parse_vps_without_timing():
+    assert nal.parse_vps_fps(HEVC_VPS) == 0.0
+
+def test_parse_sps_rejects_invalid_chroma_format():
+    # profile_idc 100 之后 chroma_format_idc 为 ue(v)，构造值 4 (00101)
+    sps = bytes([0x67, 100, 0x00, 40, 0b10010100, 0b00000000])
+    with pytest.raises(ValueError):
+        nal.parse_sps(sps, nal.H264)
@@ -0,0 +1,162 @@
+import os
+import asyncio
+
+import pytest
+
+from micam.nal import FrameInfo
+from micam.output import DROP_NEWEST, DROP_OLDEST, DROP_KEYFRAME, FrameQueue, GopBuffer, PipeWriter
+
+class ManualQueue(FrameQueue):
+    """写出由测试控制: blocked 时 _flush 不写出，模拟输出端阻塞"""
+    def __init__(self, *args, **kwargs):
+        super().__init__("test", *args, **kwargs)
+        self.blocked = True
+        self.sent = []
+
+    def _flush(self):
+        while self.queue and not self.blocked:
+            data, keyframe, at = self.queue.popleft()
+            self.queued_bytes -= len(data)
+            self.sent.append(data)
+        self._waiting = bool(self.queue)
+
+    def unblock(self):
+        self.blocked = False
+        self._flush()
+
+def queued(q):
+    return [item[0] for item in q.queue]
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ManualQueue(policy="random")
+
+def test_write_passes_through_when_not_blocked():
+    q = ManualQueue(max_bytes=10)
+    q.blocked = False
+    for _ in range(5):
+        assert q.write(b"x" * 8)
+    assert len(q.sent) == 5
+    assert q.dropped_frames == 0
+
+def test_drop_newest():
+    q = ManualQueue(max_bytes=10, policy=DROP_NEWEST)
+    assert q.write(b"a" * 4)
+    assert q.write(b"b" * 4)
+    assert not q.write(b"c" * 4)
+    assert queued(q) == [b"a" * 4, b"b" * 4]
+    assert (q.dropped_frames, q.dropped_bytes, q.queued_bytes) == (1, 4, 8)
+    q.unblock()
+    assert q.sent == [b"a" * 4, b"b" * 4]
+    assert q.queued_bytes == 0
+
+def test_drop_oldest():
+    q = ManualQueue(max_bytes=10, policy=DROP_OLDEST)
+    for c in b"abc":
+        assert q.write(bytes([c]) * 4)
+    assert queued(q) == [b"b" * 4, b"c" * 4]
+    assert (q.dropped_frames, q.queued_bytes) == (1, 8)
+
+def test_drop_oldest_keeps_partial_head():
+    q = ManualQueue(max_bytes=10, policy=DROP_OLDEST)
+    q.write(b"a" * 4)
+    q.write(b"b" * 4)
+    q._partial = True
+    assert q.write(b"c" * 4)
+    assert queued(q) == [b"a" * 4, b"c" * 4]
+
+def test_drop_oldest_larger_than_queue():
+    q = ManualQueue(max_bytes=10, policy=DROP_OLDEST)
+    q.write(b"a" * 4)
+    assert not q.write(b"b" * 11)
+    assert q.queued_bytes == 0
+    assert q.dropped_frames == 2
+
+def test_drop_keyframe_resyncs_on_next_keyframe():
+    q = ManualQueue(max_bytes=10, policy=DROP_KEYFRAME)
+    assert q.write(b"K" * 4, keyframe=True)
+    assert q.write(b"p" * 4)
+    # 非关键帧溢出后丢弃到下一个关键帧为止
+    assert not q.write(b"q" * 4)
+    assert not q.write(b"r" * 1)
+    assert queued(q) == [b"K" * 4, b"p" * 4]
+    # 新关键帧替换积压的旧 GOP
+    assert q.write(b"L" * 4, keyframe=True)
+    assert queued(q) == [b"K" * 4, b"L" * 4]
+    assert q.dropped_frames == 3
+
+def test_drop_keyframe_keeps_partial_head():
+    q = ManualQueue(max_bytes=10, policy=DROP_KEYFRAME)
+    q.write(b"K" * 4, keyframe=True)
+    q.write(b"p" * 4)
+    q._partial = True
+    assert q.write(b"L" * 6, keyframe=True)
+    assert queued(q) == [b"K" * 4, b"L" * 6]
+
+def test_resync():
+    q = ManualQueue(max_bytes=100)
+    q.resync()
+    assert not q.write(b"p")
+    assert q.write(b"K", keyframe=True)
+    assert q.write(b"p")
+    assert queued(q) == [b"K", b"p"]
+
+def test_arrival_time_is_kept():
+    q = ManualQueue(max_bytes=100)
+    q.write(b"a", at=1.5)
+    q.write(b"b")
+    assert list(q.queue) == [(b"a", False, 1.5), (b"b", False, None)]
+
+def test_close_rejects_writes():
+    q = ManualQueue(max_bytes=100)
+    q.write(b"a")
+    q.close()
+    assert q.queued_bytes == 0
+    assert not q.write(b"b")
+
+def test_pipe_writer_partial_writes(tmp_path):
+    async def run():
+        path = str(tmp_path / "video.pipe")
+        w = PipeWriter(path, "video", max_bytes=1 << 20)
+        w.start()
+        reader = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            frames = [bytes([i]) * 100_000 for i in range(4)]
+            for f in frames:
+                assert w.write(f)
+            # 管道缓冲区远小于 400 KB，队首只写入一部分
+            assert w._waiting and w._partial
+            received = bytearray()
+            while len(received) < 400_000:
+                try:
+                    received += os.read(reader, 65536)
+                except BlockingIOError:
+                    await asyncio.sleep(0.001)
+            assert bytes(received) == b"".join(frames)
+            await asyncio.sleep(0.01)
+            assert not w.queue and not w._waiting and not w._partial
+            assert (w.queued_bytes, w.written_bytes) == (0, 400_000)
+        finally:
+            w.close()
+            os.close(reader)
+        assert not os.path.exists(path)
+    asyncio.run(run())
+
+def test_gop_buffer():
+    key = FrameInfo(True, True, True)
+    delta = FrameInfo(False, False, True)
+    gop = GopBuffer(max_bytes=10)
+    gop.add_video(b"p" * 2, delta)
+    assert gop.items == []
+    gop.add_video(b"K" * 4, key)
+    gop.add_video(b"p" * 4, delta)
+    assert [p for p, _, _ in gop.items] == [b"K" * 4, b"p" * 4]
+    assert gop.items[0][2] <= gop.items[1][2]
+    assert gop.bytes == 8
+    # 超出容量时整个 GOP 丢弃，直到下一个关键帧
+    gop.add_video(b"p" * 4, delta)
+    assert (gop.items, gop.bytes, gop.overflows) == ([], 0, 1)
+    gop.add_video(b"p" * 2, delta)
+    assert gop.items == []
+    gop.add_video(b"L" * 2, key)
+    assert [p for p, _, _ in gop.items] == [b"L" * 2]